@@ -68,9 +68,20 @@ trial_protocol : str
 nwins_upperlimit : int
   Upper limit on number of windows to extract from the younger
   adults. A value of 0 means no upper limit.
+
+keep_evts_in_memory : bool
+  If True, preprocessed .evt files are kept in memory and handed straight
+  to spectral_slopes.py, rather than being written to
+  import_dir_processed_evt and read back. The results are the same either
+  way.
+
+Both stages run inside this process, so main.py can also be imported and
+its stages called directly, e.g. from a script running many analyses.
 """
 
-from subprocess import check_call
+import os
+import sys
+import glob
 
 ## PARAMETERS #################################################################
 ###############################################################################
@@ -95,58 +106,90 @@ psd_buffer_hifreq = 14
 trial_protocol    = 'match_OA'
 nwins_upperlimit  = 0
 
+# Keep preprocessed events in memory instead of writing them to disk
+keep_evts_in_memory = False
+
 # GO-NOGO-SPECIFIC PARAMETERS
 preset_analysis   = 'all_clean_data' # 'fixation_period', 'intertrial_interval', 'custom_marker'
 custom_marker     = 'FIXATION'
-window_range_lo   = -500
+window_range_lo   = -2000 # At least psd_nperwindow points, 2000 ms by default
 window_range_hi   = 0
 
 
 ## SCRIPT (Do not modify unless you know what you're doing) ###################
 ###############################################################################
 
-## RESTING STATE ANALYSIS ##
-if analysis == 'rs':
-  # Pre-process .evts based on analysis user requests
-  check_call(['python', 'src/rs/full/preprocessing/cl_evtEMSEPreprocessor.py',
-                '-i', import_dir_raw_evt,
-                '-o', import_dir_processed_evt])
-
-  # Run spectral_slopes.py
-  check_call(['python', 'src/rs/full/analysis/spectral_slopes.py',
-    '-m', montage,
-    '-i', import_dir_mat,
-    '-e', import_dir_processed_evt,
-    '-c', import_path_csv,
-    '-o', export_dir,
-    '--fittingfunc='   + fitting_func,
-    '--fittinglo='     + str(fitting_lofreq),
-    '--fittinghi='     + str(fitting_hifreq),
-    '--bufferlo='      + str(psd_buffer_lofreq),
-    '--bufferhi='      + str(psd_buffer_hifreq),
-    '--trialprotocol=' + trial_protocol,
-    '--nwinsupper='    + str(nwins_upperlimit)])
-
-## GO-NOGO ANALYSIS ##
-elif analysis == 'gng':
-  # Preprocess .evts based on analysis user requests
-  check_call(['python', 'src/gng/preprocessing/cl_evtBESAPreprocessor.py',
-                '-i', import_dir_raw_evt,
-                '-o', import_dir_processed_evt])
-
-  # Run spectral_slopes.py
-  check_call(['python', 'src/gng/analysis/spectral_slopes.py',
-    '-m', montage,
-    '-i', import_dir_mat,
-    '-e', import_dir_processed_evt,
-    '-c', import_path_csv,
-    '-o', export_dir,
-    '--fittingfunc='    + fitting_func,
-    '--fittinglo='      + str(fitting_lofreq),
-    '--fittinghi='      + str(fitting_hifreq),
-    '--bufferlo='       + str(psd_buffer_lofreq),
-    '--bufferhi='       + str(psd_buffer_hifreq),
-    '--presetanalysis=' + preset_analysis,
-    '--custommarker='   + custom_marker,
-    '--windowrangelo='  + str(window_range_lo),
-    '--windowrangehi='  + str(window_range_hi)])
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+
+
+def preprocess_evts(preprocess_evt, import_dir, export_dir=None):
+  """
+  Preprocesses every .evt file in import_dir with preprocess_evt, which
+  takes the path to a raw .evt file and returns its processed events.
+  Returns a dict of the processed events, keyed on subject name. If
+  export_dir is given, each file is also written there.
+  """
+  events = {}
+  for evt_file in sorted(glob.glob(os.path.join(import_dir, '*.evt'))):
+    name = os.path.basename(evt_file)[:-4]
+    events[name] = preprocess_evt(evt_file)
+    if export_dir is not None:
+      events[name].to_csv(os.path.join(export_dir, name + '.evt'), sep='\t', index=False)
+  return events
+
+
+def run_pipeline(preprocess_evt, spectral_slopes, params, import_dir_raw_evt,
+                 keep_evts_in_memory=False):
+  """
+  Preprocesses the raw .evt files, then runs spectral_slopes with params.
+  If keep_evts_in_memory is True, the preprocessed events are handed
+  straight to spectral_slopes.run. Otherwise they're written to
+  params['import_dir_evt'], from which spectral_slopes reads them.
+  Returns the list of Subject objects from spectral_slopes.run.
+  """
+  if keep_evts_in_memory:
+    events = preprocess_evts(preprocess_evt, import_dir_raw_evt)
+    return spectral_slopes.run(params, events)
+  preprocess_evts(preprocess_evt, import_dir_raw_evt, params['import_dir_evt'])
+  return spectral_slopes.run(params)
+
+
+if __name__ == '__main__':
+
+  ## RESTING STATE ANALYSIS ##
+  if analysis == 'rs':
+    sys.path.insert(0, os.path.join(SRC_DIR, 'rs', 'full', 'preprocessing'))
+    sys.path.insert(0, os.path.join(SRC_DIR, 'rs', 'full', 'analysis'))
+    from cl_evtEMSEPreprocessor import preprocess_evt
+    import spectral_slopes
+
+    params = spectral_slopes.default_params()
+    params['trial_protocol']   = trial_protocol
+    params['nwins_upperlimit'] = nwins_upperlimit
+
+  ## GO-NOGO ANALYSIS ##
+  elif analysis == 'gng':
+    sys.path.insert(0, os.path.join(SRC_DIR, 'gng', 'preprocessing'))
+    sys.path.insert(0, os.path.join(SRC_DIR, 'gng', 'analysis'))
+    from cl_evtBESAPreprocessor import preprocess_evt
+    import spectral_slopes
+
+    params = spectral_slopes.default_params()
+    params['preset_analysis'] = preset_analysis
+    params['custom_marker']   = custom_marker
+    params['window_range_lo'] = window_range_lo
+    params['window_range_hi'] = window_range_hi
+
+  params['montage']           = montage
+  params['import_dir_mat']    = import_dir_mat
+  params['import_dir_evt']    = import_dir_processed_evt
+  params['import_path_csv']   = import_path_csv
+  params['export_dir']        = export_dir
+  params['fitting_func']      = fitting_func
+  params['fitting_lofreq']    = fitting_lofreq
+  params['fitting_hifreq']    = fitting_hifreq
+  params['psd_buffer_lofreq'] = psd_buffer_lofreq
+  params['psd_buffer_hifreq'] = psd_buffer_hifreq
+
+  run_pipeline(preprocess_evt, spectral_slopes, params, import_dir_raw_evt,
+               keep_evts_in_memory)
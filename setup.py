@@ -0,0 +1,11 @@
+from setuptools import setup
+
+setup(
+    name='psdslope',
+    version='0.1.0',
+    description='PSD slope analysis of resting-state and Go-NoGo EEG recordings.',
+    url='https://github.com/canlabluc/psd-slope-rs-gng',
+    package_dir={'': 'src'},
+    packages=['psdslope'],
+    install_requires=['numpy', 'scipy>=1.4', 'pandas', 'pyarrow'],
+)
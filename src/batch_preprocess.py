@@ -0,0 +1,202 @@
+#!/usr/local/bin/python3
+""" batch_preprocess
+Runs one of the .evt preprocessing steps over every file in a directory,
+spreading the files over a pool of worker processes. A file is skipped when
+its output already exists and is newer than all of its inputs, so re-running
+after a change only redoes the files that are affected.
+
+Usage:
+    $ python src/batch_preprocess.py -s <step> -i <import_dir> -o <export_dir>
+        [-c <clean_dir>] [-j <jobs>] [-f]
+
+Inputs:
+    step:       Preprocessing step to run. One of:
+                    emse:         cl_evtEMSEPreprocessor (resting state)
+                    besa:         cl_evtBESAPreprocessor (Go-NoGo)
+                    besa-clean:   cl_evtBESACleanSegments (Go-NoGo)
+                    besa-correct: cl_evtBESACorrectResponses (Go-NoGo)
+    import_dir: Directory containing the .evt files to process. For
+                besa-correct, these are the files produced by the besa step.
+    export_dir: Directory in which to save processed .evt files.
+    clean_dir:  besa-correct only. Directory containing the files produced by
+                the besa-clean step.
+    jobs:       Number of worker processes. Defaults to the number of CPUs.
+    -f:         Process every file, even if its output is up to date.
+
+Example, preprocessing the Go-NoGo files end to end:
+    $ python src/batch_preprocess.py -s besa -i evt/raw/ -o evt/preprocessed/
+    $ python src/batch_preprocess.py -s besa-clean -i evt/preprocessed/ -o evt/clean/
+    $ python src/batch_preprocess.py -s besa-correct -i evt/preprocessed/ \
+        -c evt/clean/ -o evt/correct/
+
+Every file is reported with its status and processing time, and the script
+exits with a non-zero status if any file failed.
+"""
+
+import os
+import sys
+import glob
+import time
+import getopt
+import traceback
+import concurrent.futures
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SRC_DIR, 'rs', 'full', 'preprocessing'))
+sys.path.insert(0, os.path.join(SRC_DIR, 'gng', 'preprocessing'))
+
+import cl_evtEMSEPreprocessor
+import cl_evtBESAPreprocessor
+import cl_evtBESACleanSegments
+import cl_evtBESACorrectResponses
+
+# Per-file function run by each step. Each takes its input file(s) followed
+# by the path of the output file.
+STEPS = {
+    'emse':         cl_evtEMSEPreprocessor.preprocess_file,
+    'besa':         cl_evtBESAPreprocessor.preprocess_file,
+    'besa-clean':   cl_evtBESACleanSegments.clean_segments_file,
+    'besa-correct': cl_evtBESACorrectResponses.correct_responses_file
+}
+
+
+def is_up_to_date(inputs, output):
+    """
+    Returns True if output exists and was modified after every file in inputs.
+    Returns False if any input is missing, so that the file is run, and
+    reported as failed, rather than stopping the whole batch here.
+    """
+    try:
+        out_mtime = os.path.getmtime(output)
+        return all(os.path.getmtime(f) < out_mtime for f in inputs)
+    except OSError:
+        return False
+
+
+def run_file(step, inputs, output):
+    """
+    Runs a single step on one file. Returns (output, seconds, error), where
+    error is None on success, or the formatted traceback on failure. Errors
+    are caught here so that one bad file doesn't stop the rest of the batch.
+    The step writes to a temporary file next to output, which then replaces
+    it, so an interrupted or failed run never leaves a partial output that
+    a later run would take to be up to date.
+    """
+    start = time.perf_counter()
+    # Named after the worker rather than made by tempfile.mkstemp, so that
+    # the step creates it with the usual permissions.
+    tmp_path = '{}.{}.tmp'.format(output, os.getpid())
+    try:
+        STEPS[step](*inputs, tmp_path)
+        os.replace(tmp_path, output)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return output, time.perf_counter() - start, error
+
+
+def get_jobs(step, import_dir, export_dir, clean_dir=None):
+    """
+    Returns a list of (inputs, output) pairs, one for every .evt file in
+    import_dir.
+    """
+    jobs = []
+    for evt_file in sorted(glob.glob(os.path.join(import_dir, '*.evt'))):
+        fname = os.path.basename(evt_file)
+        inputs = [evt_file]
+        if step == 'besa-correct':
+            inputs.append(os.path.join(clean_dir, fname))
+        jobs.append((inputs, os.path.join(export_dir, fname)))
+    return jobs
+
+
+def run_batch(step, import_dir, export_dir, clean_dir=None, njobs=None, force=False):
+    """
+    Runs step over every .evt file in import_dir, writing results to
+    export_dir. Prints one line per file as it finishes.
+    Arguments
+        step:       Name of the step to run. See STEPS.
+        import_dir: Directory containing the input .evt files.
+        export_dir: Directory in which to save the processed .evt files.
+        clean_dir:  Directory containing the clean segment files. Only used
+                    by the besa-correct step.
+        njobs:      Number of worker processes. None uses every CPU.
+        force:      If True, process files even if their output is up to date.
+    Returns
+        List of (output, seconds, error) tuples for the files that were
+        processed, in the order they finished.
+    """
+    if step not in STEPS:
+        raise ValueError("Unknown step '{}'. Options: {}".format(step, ', '.join(STEPS)))
+    if step == 'besa-correct' and clean_dir is None:
+        raise ValueError('The besa-correct step requires a clean_dir.')
+    os.makedirs(export_dir, exist_ok=True)
+
+    jobs = get_jobs(step, import_dir, export_dir, clean_dir)
+    todo = []
+    for inputs, output in jobs:
+        if not force and is_up_to_date(inputs, output):
+            print('SKIP  {}'.format(os.path.basename(output)))
+        else:
+            todo.append((inputs, output))
+
+    results = []
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=njobs) as executor:
+        futures = [executor.submit(run_file, step, inputs, output)
+                   for inputs, output in todo]
+        for future in concurrent.futures.as_completed(futures):
+            output, seconds, error = future.result()
+            status = 'OK  ' if error is None else 'FAIL'
+            print('{}  {}  {:.2f}s'.format(status, os.path.basename(output), seconds))
+            if error is not None:
+                print(error)
+            results.append((output, seconds, error))
+
+    nfailed = sum(error is not None for _, _, error in results)
+    print('Processed {} files ({} failed, {} skipped) in {:.2f}s.'.format(
+        len(results), nfailed, len(jobs) - len(todo), time.perf_counter() - start))
+    return results
+
+
+def main(argv):
+    help_msg = ('\tbatch_preprocess.py -s <step> -i <import_dir> -o <export_dir>'
+                ' [-c <clean_dir>] [-j <jobs>] [-f]\n'
+                '\tsteps: ' + ', '.join(STEPS) + '\n')
+    params = {'clean_dir': None, 'jobs': None, 'force': False}
+    try:
+        opts, args = getopt.getopt(argv[1:], 'hs:i:o:c:j:f')
+    except getopt.GetoptError:
+        print('Error: Bad input. To run:\n')
+        print(help_msg)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print('Help:\n')
+            print(help_msg)
+            sys.exit(2)
+        elif opt == '-s':
+            params['step'] = arg
+        elif opt == '-i':
+            params['import_dir'] = arg
+        elif opt == '-o':
+            params['export_dir'] = arg
+        elif opt == '-c':
+            params['clean_dir'] = arg
+        elif opt == '-j':
+            params['jobs'] = int(arg)
+        elif opt == '-f':
+            params['force'] = True
+
+    results = run_batch(params['step'], params['import_dir'], params['export_dir'],
+                        params['clean_dir'], params['jobs'], params['force'])
+    if any(error is not None for _, _, error in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
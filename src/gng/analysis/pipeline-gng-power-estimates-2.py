@@ -100,6 +100,7 @@ def compute_subject_psds(import_path, import_path_csv):
     matfiles = get_filelist(import_path)
     df = pd.read_csv(import_path_csv)
     df.SUBJECT = df.SUBJECT.astype(str)
+    info = df.set_index('SUBJECT')
 
     subj = {}
     subj['nbsubj'] = len(matfiles)
@@ -109,9 +110,9 @@ def compute_subject_psds(import_path, import_path_csv):
         
         subj = import_subject(subj, i, matfiles[i])
         print(subj[i]['name'])
-        subj[i]['age']   = df[df.SUBJECT == subj[i]['name']].AGE.values[0]
-        subj[i]['class'] = df[df.SUBJECT == subj[i]['name']].CLASS.values[0]
-        subj[i]['sex']   = df[df.SUBJECT == subj[i]['name']].SEX.values[0]
+        subj[i]['age']   = info.at[subj[i]['name'], 'AGE']
+        subj[i]['class'] = info.at[subj[i]['name'], 'CLASS']
+        subj[i]['sex']   = info.at[subj[i]['name'], 'SEX']
 
         for ch in range(subj[i]['nbchan']):
             subj[i][ch] = {}            
@@ -162,6 +162,7 @@ def compute_subject_psds(import_path, import_path_csv):
     matfiles = get_filelist(import_path)
     df = pd.read_csv(import_path_csv)
     df.SUBJECT = df.SUBJECT.astype(str)
+    info = df.set_index('SUBJECT')
 
     subj = {}
     subj['nbsubj'] = len(matfiles)
@@ -171,9 +172,9 @@ def compute_subject_psds(import_path, import_path_csv):
     for i in range(len(matfiles)):
         
         subj = import_subject(subj, i, matfiles[i])
-        subj[i]['age']   = df[df.SUBJECT == subj[i]['name']].AGE.values[0]
-        subj[i]['class'] = df[df.SUBJECT == subj[i]['name']].CLASS.values[0]
-        subj[i]['sex']   = df[df.SUBJECT == subj[i]['name']].SEX.values[0]
+        subj[i]['age']   = info.at[subj[i]['name'], 'AGE']
+        subj[i]['class'] = info.at[subj[i]['name'], 'CLASS']
+        subj[i]['sex']   = info.at[subj[i]['name'], 'SEX']
 
         for ch in range(subj[i]['nbchan']):
             subj[i][ch] = {}
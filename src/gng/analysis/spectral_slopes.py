@@ -1,241 +1,128 @@
 #!/usr/local/bin/python3
 """
 Computes PSDs and fits line to specified frequency range in PSD for
-the sensor-level Go-NoGo data.
-Change the parameters below prior to running.
+the Go-NoGo data. Which parts of the recording the PSDs are computed
+from is chosen by the preset analysis, e.g. all clean data, or the
+fixation period of every trial.
+Change the parameters below prior to running, or pass them on the
+command line. The analysis itself is run by psdslope.pipeline.
 """
 
 import os
 import sys
-import glob
-import getopt
-import datetime
-
-import numpy as np
-import scipy as sp
-import pandas as pd
-import scipy.io
-import scipy.signal
-from sklearn import linear_model
 from collections import OrderedDict
 
-from subject import Subject
+# Use the psdslope package from this checkout if it isn't installed.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from psdslope import CleanSpace, MarkerWindows, BetweenMarkers, pipeline
 
-###############################################################################
+USAGE = '\tspectral_slopes.py -m <montage> -i <import_dir> -e <import_dir_evt> -o <export_dir>\n'
 
-def get_filelist(import_path, extension):
-    """
-    Returns list of file paths from import_path with specified extension.
-    """
-    filelist = []
-    for root, dirs, files in os.walk(import_path):
-        filelist += glob.glob(os.path.join(root, '*.' + extension))
-        return filelist
-
-
-def get_subject_slopes(subj, ch, slope_type):
-    """ Returns list of slopes for specified channel of slope_type.
-    Arguments:
-        subj:       Dictionary of Subject objects.
-        ch:         Scalar, channel for which to get list of subject slopes.
-        slope_type: String, e.g., 'eyesc_slope' or 'eyeso_slope'
-    """
-    return [subj[i].psds[ch][slope_type + '_slope'][0] for i in range(subj['nbsubj'])]
+# Command-line flags of the Go-NoGo parameters, see pipeline.FLAGS.
+FLAGS = OrderedDict([
+    ('presetanalysis=', 'preset_analysis'),
+    ('custommarker=',   'custom_marker'),
+    ('windowrangelo=',  'window_range_lo'),
+    ('windowrangehi=',  'window_range_hi')
+])
 
 ###############################################################################
 
-def main(argv):
-    """
-    Parameters : Change these before running.
+def get_selectors(params):
+    """ Returns an OrderedDict holding the segment selector for the preset
+    analysis, keyed on its condition label.
+    Parameters
     ----------
-    montage : string
-        montage we're running spectral_slopes on. Options are:
-            'dmn': Default mode network source model.
-            'frontal': Frontal source model.
-            'dorsal': Dorsal attention source model.
-            'ventral': Ventral attention source model.
-            'sensor-level': For running the original sensor-level data.
-
-    psd_buffer_lofreq : float
-        lower frequency bound for the PSD buffer we exclude from fitting.
-
-    psd_buffer_hifreq : float
-        upper frequency bound for the PSD buffer we exclude from fitting.
-
-    fitting_func : string
-        function we use for fitting to the PSDs. Options are:
-            'linreg': Simple linear regression.
-            'ransac': RANSAC, a robust fitting method.
-
-    fitting_lofreq : float
-        upper frequency bound for the PSD fitting.
-
-    fitting_hifreq : float
-        lower frequency bound for the PSD fitting.
-
-    nwins_upperlimit : int
-        upper limit on number of windows to extract from the younger
-        adults. A value of 0 means no upper limit.
+        params : dict
+            Run parameters. Uses 'preset_analysis', and for the
+            'custom_marker' preset also 'custom_marker', 'window_range_lo'
+            and 'window_range_hi'.
+    """
+    preset = params['preset_analysis']
+    if preset == 'all_clean_data':
+        label, selector = 'clean', CleanSpace()
+    elif preset == 'fixation_period':
+        label, selector = 'fixation', BetweenMarkers(['FIXATION'], ['GO_PROMPT', 'NOGO_PROMPT'])
+    elif preset == 'intertrial_interval':
+        label, selector = 'intertrial', BetweenMarkers(['RESPONSE'], ['FIXATION'])
+    elif preset == 'custom_marker':
+        label, selector = params['custom_marker'].lower(), MarkerWindows(
+            [params['custom_marker']], params['window_range_lo'], params['window_range_hi'])
+    else:
+        raise Exception('ERROR: Preset analysis not recognized.')
+    return OrderedDict([(label, selector)])
 
-    protocol : string
-        specifies
-        specifies whether to cut younger adult trials down by half in
-        order to make them match older adult trial lengths.
+###############################################################################
 
-    import_dir_mat : string
-        directory from which we import .mat files.
+def default_params():
+    """
+    Returns the run parameters, along with the date and commit of the run.
+    The parameters shared with the resting-state analysis are described in
+    psdslope.pipeline.default_params.
 
+    Parameters : Change these before running, or change them through
+    the command-line flags.
+    ----------
+    preset_analysis : string
+        Command-line flag: --presetanalysis=
+        which segments of the recording to compute PSDs from. Options are:
+            'all_clean_data': every clean segment.
+            'fixation_period': from each FIXATION to the GO/NOGO prompt.
+            'intertrial_interval': from each RESPONSE to the next FIXATION.
+            'custom_marker': the window [window_range_lo, window_range_hi]
+                around every custom_marker.
+        Only the clean parts of these segments are used. Note that PSDs
+        are computed from windows of psd_nperwindow points (2 seconds by
+        default), so shorter segments are skipped, and a run stops with
+        an error if a subject has none left.
+    custom_marker : string
+        Command-line flag: --custommarker=
+        marker for the 'custom_marker' preset, e.g. 'FIXATION'.
+    window_range_lo, window_range_hi : int
+        Command-line flags: --windowrangelo=, --windowrangehi=
+        window around custom_marker, in milliseconds. Must span at least
+        psd_nperwindow points, i.e. 2000 ms by default.
     import_dir_evt : string
-        directory from which we import .evt files.
-
-    export_dir : string
-        directory to which we export the results .csv file.
+        Command-line flag: -e
+        directory from which we import .evt files. Either clean segment
+        files from cl_evtBESACleanSegments, or preprocessed files from
+        cl_evtBESAPreprocessor; the marker presets need the latter.
     """
 
-    params = OrderedDict()
-    params['recompute_psds']    = True
-    params['psd_buffer_lofreq'] = 7
-    params['psd_buffer_hifreq'] = 14
-    params['fitting_func']      = 'ransac'
+    params = pipeline.default_params()
     params['fitting_lofreq']    = 14
     params['fitting_hifreq']    = 34
-    params['nwins_upperlimit']  = 0
-    params['protocol']          = 'all_clean' # 'all_clean_space', 'correct_go_trials', 'correct_nogo_trials',
+    params['preset_analysis']   = 'all_clean_data'
+    params['custom_marker']     = 'FIXATION'
+    params['window_range_lo']   = -2000
+    params['window_range_hi']   = 0
     params['import_path_csv']   = 'data/auxilliary/ya-oa.csv'
     params['import_dir_mat']    = 'data/gng/ExclFiltCARClust-mat/'
     params['import_dir_evt']    = 'data/gng/evt/clean/'
-    params['export_dir']        = 'data/runs/'
+    return params
 
-    ###########################################################################
 
-    # Make sure we're working at the project root.
-    # project_path = os.getcwd()
-    # os.chdir(project_path[:project_path.find('psd-slope') + len('psd-slope')] + '/')
+def get_cmdline_params(params, argv=None):
+    """ Fetches command-line parameters, see pipeline.get_cmdline_params.
+    """
+    return pipeline.get_cmdline_params(params, argv, USAGE, FLAGS)
 
-    # Generate information about current run.
-    params['Time'] = str(datetime.datetime.now()).split()[0]
-    with open('.git/refs/heads/master', 'r') as f:
-        params['commit'] = f.read()[0:7]
-    params.move_to_end('commit', last=False)
-    params.move_to_end('Time', last=False)
+
+def run(params, events=None):
+    """ Runs the analysis with the given parameters, as returned by
+    default_params, and returns the list of Subject objects that were
+    computed. See pipeline.run.
+    """
+    return pipeline.run(params, get_selectors(params), 'gng', events)
+
+
+def main(argv):
+    params = default_params()
 
     # Take in command-line args, if they are present.
-    try:
-        opts, args = getopt.getopt(argv[1:], 'i:e:o:h')
-    except getopt.GetoptError:
-        print('Error: Bad input. To run:\n')
-        print('\tgng_spectral_slopes.py -m <montage> -i <import_dir> -o <export_dir>\n')
-        print('Or, manually modify program parameters and run without command-line args.')
-        sys.exit(2)
-    for opt, arg in opts:
-        if opt == '-h':
-            print('Help:\n')
-            print('\tgng_spectral_slopes.py -m <montage> -i <import_dir> -o <export_dir>\n')
-            print('Or, manually modify program parameters and run without command-line args.')
-            sys.exit(2)
-        elif opt == '-i':
-            params['import_dir_mat'] = arg
-        elif opt == '-e':
-            params['import_dir_evt'] = arg
-        elif opt == '-o':
-            params['export_dir'] = arg
-
-    # Make a directory for this run and write parameters to terminal and file.
-    export_dir_name = params['export_dir'] + '/' + params['Time'] + '/'
-    num = 1
-    while os.path.isdir(export_dir_name):
-        export_dir_name = params['export_dir'] + '/' + params['Time'] + '-' + str(num) + '/'
-        num += 1
-    params['export_dir'] = export_dir_name
-    os.mkdir(params['export_dir'])
-
-    with open(params['export_dir'] + 'parameters.txt', 'w') as params_file:
-        print()
-        for p in params:
-            line = ' {}: {}'.format(p, str(params[p]))
-            print(line)
-            params_file.write(line + '\n')
-        print()
-
-    ##########################################################################
-    # Compute PSDs and fit to slopes.
-
-    subj = {}
-    matfiles = get_filelist(params['import_dir_mat'], 'mat')
-    df = pd.read_csv(params['import_path_csv'])
-    df.SUBJECT = df.SUBJECT.astype(str)
-    df.CLASS   = df.CLASS.astype(str)
-    df.AGE     = df.AGE.astype(int)
-
-    subjects = set(map(lambda x: x.split('/')[-1][:-4], matfiles))
-    missing = subjects - set(df.SUBJECT)
-    if len(missing) != 0:
-        for s in missing:
-            print('ERROR: Specified csv does not contain information for subject {}'.format(s))
-        raise Exception('\nMissing subject information from csv. Either remove subject file from\n'+
-                        'processing pipeline or add subject information to csv file.')
-
-    subj = {}
-    subj['nbsubj'] = len(matfiles)
-    for i in range(len(matfiles)):
-
-        #######################################
-        # Import the subject
-        subj_name = matfiles[i].split('/')[-1][:-4]
-        print('Processing: {}'.format(subj_name))
-        group = df[df.SUBJECT == subj_name].CLASS.values[0]
-        age   = df[df.SUBJECT == subj_name].AGE.values[0]
-        sex   = df[df.SUBJECT == subj_name].SEX.values[0]
-        subj[i] = Subject(matfiles[i], params['import_dir_evt'] + subj_name + '.evt', group, age, sex)
-
-        #######################################
-        # Compute PSDs
-
-        if params['protocol'] == 'correct_go_trials':
-
-        print('Done.')
-
-        #######################################
-        # Fit to PSD slopes
-        print('Fitting slopes... ', end='')
-        if params['fitting_func'] == 'linreg':
-            regr = subj[i].linreg_slope
-        elif params['fitting_func'] == 'ransac':
-            regr = subj[i].ransac_slope
-        subj[i].fit_slopes(params['fitting_func'], params['psd_buffer_lofreq'],
-                           params['psd_buffer_hifreq'], params['fitting_lofreq'],
-                           params['fitting_hifreq'])
-        print('Done.\n')
-
-    filename = (params['export_dir'] + 'subj-' + str(params['fitting_lofreq']) +
-                '-' + str(params['fitting_hifreq']) + '-' + params['fitting_func'] + '.npy')
-    subj['time_computed'] = params['Time']
-    np.save(filename, subj)
-
-    ##########################################################################
-    # Construct Pandas dataframe and export results to .csv file.
-
-    # Construct Pandas dataframe with subject information and slopes.
-    data = {}
-    data['SUBJECT'] = [subj[i].name for i in range(subj['nbsubj'])]
-    data['CLASS']   = [subj[i].group for i in range(subj['nbsubj'])]
-    data['AGE']     = [subj[i].age for i in range(subj['nbsubj'])]
-    data['NWINDOWS_EYESC'] = [subj[i].nwins_eyesc for i in range(subj['nbsubj'])]
-    data['NWINDOWS_EYESO'] = [subj[i].nwins_eyeso for i in range(subj['nbsubj'])]
-    df = pd.DataFrame(data)
-    df = df[['SUBJECT', 'CLASS', 'AGE', 'NWINDOWS_EYESC', 'NWINDOWS_EYESO']]
-    for ch in range(len(channels)):
-        df[channels[ch] + '_EYESC'] = get_subject_slopes(subj, ch, 'eyesc')
-    for ch in range(len(channels)):
-        df[channels[ch] + '_EYESO'] = get_subject_slopes(subj, ch, 'eyeso')
-
-    # Export results to file directory.
-    filename = (params['export_dir'] + 'rs-full-' + '-' +
-                params['fitting_func'] + '-' + str(params['fitting_lofreq']) +
-                '-' + str(params['fitting_hifreq']) + '.csv')
-    print('Saving fitted slopes at:\n', filename)
-    df.to_csv(filename, index=False)
+    params = get_cmdline_params(params, argv)
+    run(params)
 
 
 if __name__ == '__main__':
-    main(sys.argv[:])
+    main(sys.argv)
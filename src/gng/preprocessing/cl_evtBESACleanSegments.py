@@ -54,70 +54,74 @@ import glob
 import numpy as np
 import pandas as pd
 
-import_path = sys.argv[1]
-export_path = sys.argv[2]
-
-evt_files = []
-for root, dirs, files in os.walk(import_path):
-    evt_files += glob.glob(os.path.join(root, '*.evt'))
-
-for i in range(len(evt_files)):
-    df = pd.read_csv(evt_files[i], sep='\t')
-    df = df[df.Trigger.isin(['BLINK1', 'ARTFCT1', 'ARTFCT2'])]
-    # Add end of blinks (400ms after BLINK1):
-    blinks = df[df.Trigger.isin(['BLINK1'])]
-    for j in range(blinks.shape[0]):
-        # 400ms ~ 205 sampling points
-        lat  = blinks.iloc[j].Latency + 205
-        trig = 'BLINK2'
-        df = df.append({'Latency': lat, 'Trigger': trig}, ignore_index=True)
-    df = df.sort_values('Latency')
-    df = df.set_index(np.arange(0, df.shape[0], 1))
-
-    # We're going to construct a dataframe that only contains event codes
-    # marking clean segments of the recording. We start with creating an empty
-    # dataframe with columns for Latency and Trigger.
-    clean = pd.DataFrame(columns=['Latency', 'Trigger'])
-
-    # Drop all recording data prior to the beginning of trials.
-    clean_idx = 0
-    for j in range(df.shape[0]):
-        if df.iloc[j].Trigger == 'ARTFCT2':
-            clean_idx = j
-            break
-    clean = clean.append({'Latency': df.iloc[clean_idx].Latency,
-                          'Trigger': 'C1'}, ignore_index=True)
-    df = df.drop(np.arange(0, clean_idx+1, 1))
-
-    # Grab all segments of recording that occur between blinks and artifacts.
-    # These segments are added to the clean dataframe.
-    for j in range(df.shape[0]):
-        if df.iloc[j].Trigger == 'BLINK1':
-            clean = clean.append({'Latency': df.iloc[j].Latency,
-                                  'Trigger': 'C2'}, ignore_index=True)
-            clean = clean.append({'Latency': df.iloc[j+1].Latency,
-                                  'Trigger': 'C1'}, ignore_index=True)
-        if df.iloc[j].Trigger == 'ARTFCT1':
-            clean = clean.append({'Latency': df.iloc[j].Latency,
-                                  'Trigger': 'C2'}, ignore_index=True)
-            for k in range(j, df.shape[0]):
-                if df.iloc[k].Trigger == 'ARTFCT2':
-                    clean = clean.append({'Latency': df.iloc[k].Latency,
-                                          'Trigger': 'C1'}, ignore_index=True)
-                    break
-
-    # Of the clean segments that were grabbed, drop all which are shorter than
-    # two seconds.
-    bad_idx = []
-    for j in range(clean.shape[0] - 1):
-        if (clean.iloc[j].Trigger == 'C1' and clean.iloc[j+1].Trigger == 'C2') and\
-           (clean.iloc[j+1].Latency - clean.iloc[j].Latency < 1024):
-           bad_idx.append(j); bad_idx.append(j+1)
-    clean = clean.drop(bad_idx)
-    clean = clean.set_index(np.arange(0, clean.shape[0], 1))
-
-    if clean.iloc[-1].Trigger == 'C1':
-        clean = clean.drop(clean.shape[0] - 1)
-
-    subj_name = evt_files[i].split('/')[-1][:-4]
-    clean.to_csv(export_path + '/' + subj_name + '.evt', sep='\t', index=False)
+# Use the psdslope package from this checkout if it isn't installed.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from psdslope.events import clean_intervals
+
+
+def clean_segments(df, blink_length=205, min_length=1024):
+    """
+    Returns a dataframe containing only C1/C2 codes, marking the beginning and
+    end of every clean segment in a preprocessed recording. Blinks cover
+    [BLINK1, BLINK1 + blink_length], and each ARTFCT1 runs until the next
+    ARTFCT2. Everything prior to the first ARTFCT2 (the beginning of trials)
+    and after the last blink or artifact is dropped, as are clean segments
+    shorter than min_length points.
+    Arguments
+        df:           Dataframe of a preprocessed evt file, with Latency and
+                      Trigger columns.
+        blink_length: Length of a blink, in points. 400ms ~ 205 points.
+        min_length:   Shortest clean segment to keep. 2s = 1024 points.
+    """
+    trigger = df.Trigger.values
+    latency = df.Latency.values.astype(np.float64)
+    blinks = latency[trigger == 'BLINK1']
+    art_starts = latency[trigger == 'ARTFCT1']
+    art_stops = np.sort(latency[trigger == 'ARTFCT2'])
+    if len(blinks) + len(art_starts) + len(art_stops) == 0:
+        return pd.DataFrame(columns=['Latency', 'Trigger'])
+
+    # Drop all recording data prior to the beginning of trials, which is
+    # marked by the first ARTFCT2.
+    if len(art_stops):
+        start = art_stops[0]
+    else:
+        start = np.concatenate([blinks, art_starts]).min()
+
+    # Pair each ARTFCT1 with the first ARTFCT2 at or after it. Artifacts
+    # which are never closed run to the end of the recording.
+    nxt = np.searchsorted(art_stops, art_starts, side='left')
+    art_stops = np.append(art_stops, np.inf)[nxt]
+
+    starts, stops = clean_intervals(np.concatenate([blinks, art_starts]),
+                                    np.concatenate([blinks + blink_length, art_stops]),
+                                    start, min_length)
+    return pd.DataFrame({'Latency': np.column_stack([starts, stops]).ravel(),
+                         'Trigger': np.tile(['C1', 'C2'], len(starts))})
+
+
+def clean_segments_file(evt_file, export_file):
+    """
+    Reads a preprocessed .evt file, and writes its clean segments to
+    export_file.
+    """
+    df = pd.read_csv(evt_file, sep='\t')
+    clean = clean_segments(df)
+    clean.to_csv(export_file, sep='\t', index=False)
+
+
+def main(argv):
+    import_path = argv[1]
+    export_path = argv[2]
+
+    evt_files = []
+    for root, dirs, files in os.walk(import_path):
+        evt_files += glob.glob(os.path.join(root, '*.evt'))
+
+    for evt_file in evt_files:
+        subj_name = evt_file.split('/')[-1][:-4]
+        clean_segments_file(evt_file, export_path + '/' + subj_name + '.evt')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
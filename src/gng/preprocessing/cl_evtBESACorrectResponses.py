@@ -45,19 +45,14 @@ import glob
 import numpy as np
 import pandas as pd
 
-importpath_conso = sys.argv[1]
-importpath_clean = sys.argv[2]
-exportpath       = sys.argv[3]
-
-evt_files = []
-for root, dirs, files in os.walk(importpath_conso):
-    evt_files += glob.glob(os.path.join(root, '*.evt'))
-
-for i in range(len(evt_files)):
-    # Open the file, retaining only prompt and response-related data.
-    subj_name = evt_files[i].split('/')[-1][:-4]
-    df      = pd.read_csv(importpath_conso + subj_name + '.evt', sep='\t')
-    cleandf = pd.read_csv(importpath_clean + subj_name + '.evt', sep='\t')
+
+def correct_responses(df, cleandf):
+    """
+    Returns the artifact-free correct responses of a recording.
+    Arguments
+        df:      Dataframe of the evt file produced by cl_evtBESAPreprocessor.
+        cleandf: Dataframe of the evt file produced by cl_evtBESACleanSegments.
+    """
     df = df[df.Trigger.isin(['GO_PROMPT', 'NOGO_PROMPT', 'RESPONSE', \
                              'INCORRECT_RESPONSE', 'NO_RESPONSE'])]
     df = df.set_index(np.arange(0, df.shape[0], 1))
@@ -95,4 +90,35 @@ for i in range(len(evt_files)):
     df = df.drop(df.index[bad_idx])
     df = df.set_index(np.arange(0, df.shape[0], 1))
 
-    df.to_csv(exportpath + '/' + subj_name + '.evt', sep='\t', index=False)
+    return df
+
+
+def correct_responses_file(preprocessed_file, clean_file, export_file):
+    """
+    Reads a subject's preprocessed and clean-segment .evt files, and writes
+    its correct responses to export_file.
+    """
+    df      = pd.read_csv(preprocessed_file, sep='\t')
+    cleandf = pd.read_csv(clean_file, sep='\t')
+    df = correct_responses(df, cleandf)
+    df.to_csv(export_file, sep='\t', index=False)
+
+
+def main(argv):
+    importpath_conso = argv[1]
+    importpath_clean = argv[2]
+    exportpath       = argv[3]
+
+    evt_files = []
+    for root, dirs, files in os.walk(importpath_conso):
+        evt_files += glob.glob(os.path.join(root, '*.evt'))
+
+    for evt_file in evt_files:
+        subj_name = evt_file.split('/')[-1][:-4]
+        correct_responses_file(importpath_conso + subj_name + '.evt',
+                               importpath_clean + subj_name + '.evt',
+                               exportpath + '/' + subj_name + '.evt')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
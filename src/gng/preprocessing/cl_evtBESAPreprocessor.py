@@ -33,17 +33,17 @@ import glob
 import numpy as np
 import pandas as pd
 
-import_path = sys.argv[1]
-export_path = sys.argv[2]
-clean_file  = True
 
-evt_files = []
-for root, dirs, files in os.walk(import_path):
-    evt_files += glob.glob(os.path.join(root, '*.evt'))
-
-for i in range(len(evt_files)):
-    print('Processing: {}...'.format(evt_files[i].split('/')[-1]), end='')
-    df = pd.read_csv(evt_files[i], sep='\t')
+def preprocess_evt(evt_file, clean_file=True):
+    """
+    Preprocesses a single raw BESA .evt file and returns it as an
+    Event/Latency dataframe.
+    Arguments
+        evt_file:    Path to a raw BESA-exported .evt file.
+        clean_file:  Whether to mark trials containing artifacts or
+                     incorrect/no responses as artifact.
+    """
+    df = pd.read_csv(evt_file, sep='\t')
     df.columns = ['Tmu', 'Code', 'Trigger', 'Comment']
     df.Trigger = list(map(lambda x: int(x) if len(x) < 3 and x != '-' else -1, list(df.Trigger)))
     df['Latency'] = round((df.Tmu / 10**6) * 512)
@@ -84,8 +84,8 @@ for i in range(len(evt_files)):
                 event = 'NO_RESPONSE'
             else:
                 #print('NOT RECOGNIZED {}: \n\tLatency: {}\n\tCode: {}\n\tTrigger: {}\n\tComment: {}'.format(\
-                #      evt_files[i].split('/')[-1], event.Latency, event.Code, event.Trigger, event.Comment))
-                event = curr_event[1]
+                #      evt_file.split('/')[-1], event.Latency, event.Code, event.Trigger, event.Comment))
+                event = curr_event.iloc[1]
         # If the current event is a valid code, add it to the list.
         if event != 'INVALID':
             events.append(event)
@@ -117,10 +117,8 @@ for i in range(len(evt_files)):
                 # Replace the FIXATION and INCORR_RESP/NO_RESP markers
                 # with artifact markers, and throw away the RESPONSE
                 # marker between them.
-                df.set_value(fixation_idx, 'Event', 'ARTFCT1')
-                df.set_value(j,            'Event', 'ARTFCT2')
-                # df.at[fixation_idx, 'Event'] = 'ARTFCT1'
-                # df.at[j,            'Event'] = 'ARTFCT2'
+                df.at[fixation_idx, 'Event'] = 'ARTFCT1'
+                df.at[j,            'Event'] = 'ARTFCT2'
                 bad_idx.append(response_idx)
 
                 # print('fixation_idx {}'.format(fixation_idx))
@@ -147,7 +145,32 @@ for i in range(len(evt_files)):
                     # markers with artifact markers.
                     df.at[j,            'Event'] = 'ARTFCT1'
                     df.at[response_idx, 'Event'] = 'ARTFCT2'
+    return df
+
+
+def preprocess_file(evt_file, export_file, clean_file=True):
+    """
+    Preprocesses a single raw BESA .evt file and writes the result to
+    export_file. See preprocess_evt.
+    """
+    df = preprocess_evt(evt_file, clean_file)
+    df.to_csv(export_file, sep='\t', index=False)
+
+
+def main(argv):
+    import_path = argv[1]
+    export_path = argv[2]
+
+    evt_files = []
+    for root, dirs, files in os.walk(import_path):
+        evt_files += glob.glob(os.path.join(root, '*.evt'))
+
+    for evt_file in evt_files:
+        subj_name = evt_file.split('/')[-1][:-4]
+        print('Processing: {}...'.format(subj_name + '.evt'), end='')
+        preprocess_file(evt_file, export_path + '/' + subj_name + '.evt')
+        print(' Done.')
+
 
-    subj_name = evt_files[i].split('/')[-1][:-4]
-    print(' Done.')
-    df.to_csv(export_path + '/' + subj_name + '.evt', sep='\t', index=False)
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,21 @@
+"""
+psdslope: computes PSDs and fits PSD slopes to EEG recordings. Shared by
+the resting-state and Go-NoGo pipelines.
+
+    subject:   Subject, a recording with its events, PSDs and slopes.
+    segments:  Segment selectors, which choose the parts of a recording
+               that PSDs are computed from.
+    spectral:  Vectorized windowing and Welch PSDs.
+    fitting:   Vectorized line fits to log-power spectra.
+    events:    Functions for cleaning up event dataframes.
+    eeg_store: Memory-mappable .npy store of EEGLAB .mat recordings.
+    results:   Long-format Parquet results of a run, and reading them back.
+    manifest:  Fingerprints of each subject's inputs, for incremental runs.
+    metadata:  Validated subject csv, joined with recordings.
+    psd_cache: On-disk cache of computed subject PSDs.
+    pipeline:  Driver shared by the spectral_slopes.py scripts.
+"""
+
+from .subject import Subject
+from .segments import (PairedCodes, CleanSpace, MarkerWindows, BetweenMarkers,
+                        RS_SELECTORS, RS_CONDITIONS)
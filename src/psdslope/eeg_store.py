@@ -0,0 +1,112 @@
+#!/usr/local/bin/python3
+""" eeg_store
+Converts EEGLAB-exported .mat files into a memory-mappable store: the EEG
+data as a .npy file (channels x samples) and a .json sidecar holding name,
+srate and chans. Subject opens the .npy with np.load(mmap_mode='r'), so only
+the samples that fall inside of clean segments are ever read from disk.
+
+Usage, from the src directory or with the psdslope package installed:
+    $ python -m psdslope.eeg_store -i <import_dir_mat> -o <export_dir>
+
+The export directory can then be given to spectral_slopes.py in place of
+the .mat directory:
+    $ python src/rs/full/analysis/spectral_slopes.py -i <export_dir> ...
+"""
+
+import os
+import sys
+import glob
+import json
+import getopt
+import hashlib
+
+import numpy as np
+import scipy as sp
+import scipy.io
+
+
+def sidecar_path(path):
+    """
+    Returns the path of the .json sidecar belonging to a .npy file.
+    """
+    return os.path.splitext(path)[0] + '.json'
+
+
+def convert_mat(matfile, export_dir):
+    """
+    Converts a single .mat file into export_dir/<name>.npy and
+    export_dir/<name>.json. Returns the path to the .npy file. Channels are
+    numbered from 0 if the .mat file has no 'chans', as Subject does.
+    """
+    datafile = sp.io.loadmat(matfile)
+    data = np.ascontiguousarray(np.squeeze(datafile['data']))
+    if 'chans' in datafile:
+        chans = [str(ch[0]) for ch in np.squeeze(datafile['chans'])]
+    else:
+        chans = [str(ch) for ch in range(len(data))]
+    info = {
+        'name':  str(np.squeeze(datafile['name'])),
+        'srate': int(np.squeeze(datafile['srate'])),
+        'chans': chans,
+        'shape': list(data.shape),
+        'dtype': str(data.dtype),
+        # Hash of the data, so that caches can fingerprint the recording
+        # without reading all of it back in.
+        'sha1':  hashlib.sha1(data.tobytes()).hexdigest()
+    }
+    subj_name = os.path.splitext(os.path.basename(matfile))[0]
+    npyfile = os.path.join(export_dir, subj_name + '.npy')
+    np.save(npyfile, data)
+    with open(sidecar_path(npyfile), 'w') as f:
+        json.dump(info, f, indent=2)
+    return npyfile
+
+
+def load(npyfile):
+    """
+    Opens a converted recording. Returns the sidecar information as a dict,
+    and the data as a read-only memory-mapped array of shape (nbchan, n_samples).
+    """
+    with open(sidecar_path(npyfile)) as f:
+        info = json.load(f)
+    return info, np.load(npyfile, mmap_mode='r')
+
+
+def fingerprint(npyfile):
+    """
+    Returns the data hash recorded in a converted recording's sidecar.
+    """
+    with open(sidecar_path(npyfile)) as f:
+        return json.load(f)['sha1']
+
+
+def main(argv):
+    help_msg = '\teeg_store.py -i <import_dir_mat> -o <export_dir>\n'
+    params = {}
+    try:
+        opts, args = getopt.getopt(argv[1:], 'hi:o:')
+    except getopt.GetoptError:
+        print('Error: Bad input. To run:\n')
+        print(help_msg)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print('Help:\n')
+            print(help_msg)
+            sys.exit(2)
+        elif opt == '-i':
+            params['import_dir_mat'] = arg
+        elif opt == '-o':
+            params['export_dir'] = arg
+
+    os.makedirs(params['export_dir'], exist_ok=True)
+    matfiles = []
+    for root, dirs, files in os.walk(params['import_dir_mat']):
+        matfiles += glob.glob(os.path.join(root, '*.mat'))
+    for matfile in sorted(matfiles):
+        print('Converting: {}'.format(os.path.basename(matfile)))
+        convert_mat(matfile, params['export_dir'])
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+"""
+Set of functions for cleaning up event dataframes.
+"""
+
+
+def clean_intervals(bad_starts, bad_stops, start, min_length=1024):
+    """
+    Takes the complement of a set of possibly overlapping bad intervals,
+    beginning at start. Returns the (starts, stops) of every clean interval
+    of at least min_length points before the beginning of the last bad
+    interval.
+    """
+    order = np.argsort(bad_starts, kind='stable')
+    bad_starts = np.asarray(bad_starts, dtype=np.float64)[order]
+    bad_stops  = np.asarray(bad_stops, dtype=np.float64)[order]
+    prev_stop = np.maximum.accumulate(np.concatenate([[start], bad_stops]))[:-1]
+    keep = bad_starts - prev_stop >= min_length
+    return prev_stop[keep], bad_starts[keep]
+
+
+def get_all_clean_space(df, min_length=1024):
+    """
+    Returns a dataframe of C1/C2 codes marking every clean segment of at least
+    min_length points, i.e. the recording between blinks (BLINK1 to the next
+    BLINK2) and artifacts (ARTFCT1 to the next ARTFCT2). Data prior to the
+    first ARTFCT2, and after the last blink or artifact, is dropped.
+    """
+    trigger = df.Trigger.values
+    latency = df.Latency.values.astype(np.float64)
+    starts = {code: np.sort(latency[trigger == code]) for code in ['BLINK1', 'ARTFCT1']}
+    stops  = {code: np.sort(latency[trigger == code]) for code in ['BLINK2', 'ARTFCT2']}
+    if sum(len(v) for v in list(starts.values()) + list(stops.values())) == 0:
+        return pd.DataFrame(columns=['Latency', 'Trigger'])
+
+    # Drop all recording data prior to the beginning of trials.
+    if len(stops['ARTFCT2']):
+        start = stops['ARTFCT2'][0]
+    else:
+        start = latency[np.isin(trigger, ['BLINK1', 'BLINK2', 'ARTFCT1'])].min()
+
+    # Close each blink and artifact at the first matching code at or after it.
+    bad_starts, bad_stops = [], []
+    for code_start, code_stop in [('BLINK1', 'BLINK2'), ('ARTFCT1', 'ARTFCT2')]:
+        nxt = np.searchsorted(stops[code_stop], starts[code_start], side='left')
+        bad_starts.append(starts[code_start])
+        bad_stops.append(np.append(stops[code_stop], np.inf)[nxt])
+
+    seg_starts, seg_stops = clean_intervals(np.concatenate(bad_starts),
+                                            np.concatenate(bad_stops),
+                                            start, min_length)
+    return pd.DataFrame({'Latency': np.column_stack([seg_starts, seg_stops]).ravel(),
+                         'Trigger': np.tile(['C1', 'C2'], len(seg_starts))})
+
+
+def get_previous_trial(code_latency, trials):
+    """
+    Returns closest previous trial to the provided latency from the dataframe
+    trials.
+    """
+    prev_trial = trials[trials.Latency < code_latency].tail(1)
+    return prev_trial.set_index(np.arange(0, prev_trial.shape[0], 1))
+
+
+def get_next_trial(code_latency, trials):
+    """
+    Returns the closest next trial to the provided latency from the dataframe
+    trials.
+    """
+    next_trial = trials[trials.Latency > code_latency].head(1)
+    return next_trial.set_index(np.arange(0, next_trial.shape[0], 1))
+
+
+def in_intertrial(code_latency, trials):
+    """
+    Returns boolean specifying whether the given latency sits inside of the
+    intertrial space defined by the dataframe trials. Latencies before the
+    first trial are in intertrial space.
+    """
+    return bool(intertrial_mask([code_latency], trials)[0])
+
+
+def _sorted_trials(trials):
+    """
+    Returns the latencies and types of trials, sorted by latency.
+    """
+    order = np.argsort(trials.Latency.values, kind='stable')
+    return trials.Latency.values[order], trials.Type.values[order].astype(str)
+
+
+def intertrial_mask(latencies, trials, trials_stop=('12', '02')):
+    """
+    Returns a boolean array specifying, for each latency, whether it sits
+    inside of the intertrial space defined by the dataframe trials. That is,
+    whether the closest previous trial code is a trial stop code, or there
+    is no previous trial code.
+    """
+    trial_latency, trial_type = _sorted_trials(trials)
+    prev = np.searchsorted(trial_latency, latencies, side='left') - 1
+    is_stop = np.isin([t[0:2] for t in trial_type], trials_stop)
+    return np.where(prev >= 0, is_stop[np.maximum(prev, 0)], True)
+
+
+def rm_intertrial_segs(df, trials_start=('11', '01'), trials_stop=('12', '02')):
+    """
+    Checks to see if there are any segments sitting completely or partially
+    in the intertrial space, and trims or removes the segments.
+    Arguments:
+        df: Pandas dataframe, contains event information. Produced by running
+            scripts in preprocessing.
+        trials_start, trials_stop: Codes marking the beginning and end of
+            trials. Only the first two characters of each Type are compared.
+    """
+    SEGS_START = ['C1', 'O1']
+    SEGS_STOP = ['C2', 'O2']
+
+    codes = np.array([str(t)[0:2] for t in df.Type])
+    latency = df.Latency.values
+    trials = df[np.isin(codes, list(trials_start) + list(trials_stop))]
+    trial_latency, _ = _sorted_trials(trials)
+    intertrial = intertrial_mask(latency, trials, trials_stop)
+
+    # Pair each segment start with its stop: the n-th C1 with the n-th C2,
+    # and likewise for O1/O2.
+    starts, stops = [], []
+    for seg_start, seg_stop in zip(SEGS_START, SEGS_STOP):
+        starts.append(np.flatnonzero(codes == seg_start))
+        stops.append(np.flatnonzero(codes == seg_stop))
+    starts, stops = np.concatenate(starts), np.concatenate(stops)
+
+    # CASE 1: Segment sits wholly in intertrial space. Remove the whole thing.
+    bad = intertrial[starts] & intertrial[stops]
+    keep = np.ones(df.shape[0], dtype=bool)
+    keep[starts[bad]] = False
+    keep[stops[bad]] = False
+
+    # CASE 2: Segment head sits inside of the intertrial space. Trim the front
+    # of the segment to the start of the next trial.
+    new_latency = latency.copy()
+    head = np.isin(codes, SEGS_START) & intertrial & keep
+    nxt = np.searchsorted(trial_latency, latency[head], side='right')
+    nxt = np.minimum(nxt, len(trial_latency) - 1)
+    new_latency[head] = trial_latency[nxt]
+
+    # CASE 3: Segment tail sits inside of the intertrial space. Trim the end
+    # of the segment to the end of the previous trial.
+    tail = np.isin(codes, SEGS_STOP) & intertrial & keep
+    prev = np.searchsorted(trial_latency, latency[tail], side='left') - 1
+    new_latency[tail] = trial_latency[np.maximum(prev, 0)]
+
+    df = df.assign(Latency=new_latency)[keep]
+    return df.set_index(np.arange(0, df.shape[0], 1))
@@ -0,0 +1,152 @@
+"""
+Vectorized line fitting for log-power spectra. Each function fits every row
+of a (n_spectra, n_freqs) matrix of PSDs at once.
+"""
+
+import numpy as np
+
+
+def linreg_fit(f, psds, mask):
+    """
+    Fits a line to log10(psds) against f over the frequencies selected by
+    mask, using ordinary least squares. Gives the same results as fitting
+    sklearn's LinearRegression to each spectrum separately.
+    Arguments
+        f:    Frequency vector, shape (n_freqs,).
+        psds: PSDs, shape (n_spectra, n_freqs).
+        mask: Boolean array, shape (n_freqs,), selecting the fitting range.
+    Returns
+        slopes:     Shape (n_spectra,).
+        intercepts: Shape (n_spectra,).
+        fitlines:   Fit evaluated at every frequency in f, shape (n_spectra, n_freqs).
+    """
+    f = np.ravel(f).astype(np.float64)
+    x = f[mask]
+    y = np.log10(np.atleast_2d(psds)[:, mask])
+    xc = x - x.mean()
+    slopes = (y - y.mean(axis=1, keepdims=True)) @ xc / (xc @ xc)
+    intercepts = y.mean(axis=1) - slopes * x.mean()
+    fitlines = intercepts[:, np.newaxis] + slopes[:, np.newaxis] * f
+    return slopes, intercepts, fitlines
+
+
+def linreg_stderr(f, stderrs, mask, correlation=None, fstep=None):
+    """
+    Propagates the standard error of each point of log10(psds) to the
+    standard error of the least-squares slope over the frequencies selected
+    by mask. The slope is a weighted sum of the points, with weights
+    c = (x - mean(x)) / sum((x - mean(x))^2), so
+        SE(slope)^2 = sum over i, j of c_i c_j SE(y_i) SE(y_j) r(i, j)
+    where r(i, j) is the correlation between the errors of points i and j,
+    given by correlation, and is the identity for independent points.
+    Arguments
+        f:           Frequency vector, shape (n_freqs,).
+        stderrs:     Standard errors of log10(psds), shape (n_spectra, n_freqs).
+        mask:        Boolean array selecting the points each slope was
+                     fitted to, shape (n_freqs,) for every spectrum alike,
+                     or (n_spectra, n_freqs), e.g. RANSAC inliers.
+        correlation: Correlation between the errors of points m frequency
+                     steps apart, for m = 0, 1, ..., e.g.
+                     spectral.bin_correlation. Points further apart are
+                     uncorrelated. None treats every point as independent.
+        fstep:       Frequency step of correlation. Defaults to the
+                     smallest gap between points of f.
+    Returns
+        Standard errors of the slopes, shape (n_spectra,).
+    """
+    f = np.ravel(f).astype(np.float64)
+    stderrs = np.atleast_2d(stderrs)
+    mask = np.broadcast_to(mask, stderrs.shape)
+    # Only frequencies some slope was fitted to take part.
+    cols = mask.any(axis=0)
+    f, stderrs, mask = f[cols], stderrs[:, cols], mask[:, cols]
+    xm = (mask * f).sum(axis=1, keepdims=True) / mask.sum(axis=1, keepdims=True)
+    xc = np.where(mask, f - xm, 0)
+    weights = np.where(mask, xc * stderrs, 0) / (xc**2).sum(axis=1, keepdims=True)
+    if correlation is None:
+        return np.sqrt(np.sum(weights**2, axis=1))
+    if fstep is None:
+        fstep = np.min(np.diff(f))
+    lags = np.rint(np.abs(f[:, np.newaxis] - f) / fstep).astype(np.int64)
+    corr = np.where(lags < len(correlation),
+                    np.asarray(correlation)[np.minimum(lags, len(correlation) - 1)], 0)
+    return np.sqrt(np.sum((weights @ corr) * weights, axis=1))
+
+
+def ransac_fit(f, psds, mask, max_trials=100, random_state=None, return_inliers=False):
+    """
+    Robustly fits a line to log10(psds) against f over the frequencies
+    selected by mask, using RANSAC specialised to 1-D line fits. Follows
+    sklearn's RANSACRegressor(LinearRegression()) defaults: each candidate
+    line passes through two randomly drawn points, points whose absolute
+    residual is within the median absolute deviation of the spectrum are
+    inliers, the candidate with the most inliers wins (ties broken by R^2 on
+    its inliers), and the final line is refit to the winner's inliers.
+    Unlike sklearn, all max_trials candidates are evaluated for every
+    spectrum, with no early stopping.
+    Arguments
+        f:              Frequency vector, shape (n_freqs,).
+        psds:           PSDs, shape (n_spectra, n_freqs).
+        mask:           Boolean array, shape (n_freqs,), selecting the fitting range.
+        max_trials:     Number of candidate lines drawn per spectrum.
+        random_state:   Seed for drawing candidates. Fixing it makes fits
+                        reproducible.
+        return_inliers: Also returns the inliers each line was refit to.
+    Returns
+        slopes:     Shape (n_spectra,).
+        intercepts: Shape (n_spectra,).
+        fitlines:   Fit evaluated at every frequency in f, shape (n_spectra, n_freqs).
+        inliers:    If return_inliers, a boolean mask of each spectrum's
+                    inliers, shape (n_spectra, n_freqs), e.g. the mask to
+                    pass to linreg_stderr.
+    """
+    f = np.ravel(f).astype(np.float64)
+    x = f[mask]
+    y = np.log10(np.atleast_2d(psds)[:, mask])
+    nspectra, npoints = y.shape
+    threshold = np.median(np.abs(y - np.median(y, axis=1, keepdims=True)), axis=1)
+
+    # Draw two distinct points for every candidate line up front, so that
+    # results don't depend on how spectra are split into blocks below.
+    rng = np.random.RandomState(random_state)
+    first = rng.randint(0, npoints, size=(nspectra, max_trials))
+    second = rng.randint(0, npoints - 1, size=(nspectra, max_trials))
+    second += second >= first
+
+    inliers = np.zeros(y.shape, dtype=bool)
+    for block in range(0, nspectra, 1024):
+        rows = np.arange(block, min(block + 1024, nspectra))[:, np.newaxis]
+        i, j = first[rows[:, 0]], second[rows[:, 0]]
+        cand_slopes = (y[rows, j] - y[rows, i]) / (x[j] - x[i])
+        cand_intercepts = y[rows, i] - cand_slopes * x[i]
+
+        # Residuals of every point from every candidate, (block, max_trials, npoints).
+        yb = y[rows[:, 0], np.newaxis, :]
+        resid = yb - (cand_intercepts[..., np.newaxis] + cand_slopes[..., np.newaxis] * x)
+        cand_inliers = np.abs(resid) <= threshold[rows][..., np.newaxis]
+        ninliers = cand_inliers.sum(axis=2)
+
+        # R^2 of each candidate on its own inliers.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ymean = np.where(cand_inliers, yb, 0).sum(axis=2) / ninliers
+            ss_res = np.where(cand_inliers, resid**2, 0).sum(axis=2)
+            ss_tot = np.where(cand_inliers, (yb - ymean[..., np.newaxis])**2, 0).sum(axis=2)
+            score = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.where(ss_res == 0, 1.0, 0.0))
+
+        score[ninliers < ninliers.max(axis=1, keepdims=True)] = -np.inf
+        best = np.argmax(score, axis=1)
+        inliers[rows[:, 0]] = cand_inliers[np.arange(len(rows)), best]
+
+    # Refit each spectrum's line to its inliers by least squares.
+    n = inliers.sum(axis=1)
+    xm = (inliers * x).sum(axis=1) / n
+    ym = np.where(inliers, y, 0).sum(axis=1) / n
+    xc = np.where(inliers, x - xm[:, np.newaxis], 0)
+    slopes = (xc * (y - ym[:, np.newaxis])).sum(axis=1) / (xc**2).sum(axis=1)
+    intercepts = ym - slopes * xm
+    fitlines = intercepts[:, np.newaxis] + slopes[:, np.newaxis] * f
+    if return_inliers:
+        fitted = np.zeros((nspectra, len(f)), dtype=bool)
+        fitted[:, mask] = inliers
+        return slopes, intercepts, fitlines, fitted
+    return slopes, intercepts, fitlines
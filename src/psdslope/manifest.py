@@ -0,0 +1,116 @@
+"""
+Manifests of the inputs behind a run's results, for incremental runs.
+
+Every run writes manifest.csv to its export directory, holding a
+fingerprint of each subject's inputs: the .mat (or .npy) and .evt files,
+the subject's CLASS, AGE and SEX, and every run parameter that affects
+results. An incremental run compares its own fingerprints against a
+previous run's manifest, recomputes only the subjects that are new or
+whose fingerprint changed, and copies the rest from the previous run's
+results.
+"""
+
+import os
+import hashlib
+
+import pandas as pd
+
+from . import eeg_store
+
+MANIFEST_FILE = 'manifest.csv'
+
+# Bump whenever the results written for the same inputs change, e.g. gain
+# columns, so that incremental runs recompute subjects from older runs.
+RESULTS_VERSION = 5
+
+# Run parameters which don't change a run's results, and so are left out of
+# fingerprints. precision_check isn't one of them: subjects reused by an
+# incremental run would be missing from its precision.csv.
+RUN_PARAMS = ['time', 'commit', 'export_dir', 'jobs', 'psd_cache_dir', 'psd_cache_mb',
+              'import_dir_mat', 'import_dir_evt', 'import_path_csv', 'incremental',
+              'psd_threads']
+
+
+def hash_file(path, blocksize=2**20):
+    """
+    Returns the SHA-1 hex digest of the file at path.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_events(df):
+    """
+    Returns the SHA-1 hex digest of a processed events dataframe. This is
+    the digest of the .evt file the dataframe would be written to, so
+    events kept in memory hash the same as those read from disk.
+    """
+    return hashlib.sha1(df.to_csv(sep='\t', index=False).encode()).hexdigest()
+
+
+def hash_settings(params):
+    """
+    Returns the SHA-1 hex digest of the run parameters that affect results,
+    i.e. all of params except RUN_PARAMS, along with RESULTS_VERSION.
+    """
+    settings = sorted((key, str(value)) for key, value in params.items()
+                      if key not in RUN_PARAMS)
+    settings.append(('results_version', str(RESULTS_VERSION)))
+    return hashlib.sha1(repr(settings).encode()).hexdigest()
+
+
+def input_fingerprint(matfile, evtfile, group, age, sex, settings):
+    """
+    Returns the fingerprint of a single subject's inputs.
+    Arguments
+        matfile:  Path to the subject's .mat file, or .npy file converted by
+                  eeg_store, whose sidecar hash is used instead of reading it.
+        evtfile:  Path to the subject's processed .evt file, or its events
+                  as a dataframe.
+        group, age, sex: Subject information from the auxilliary csv.
+        settings: Hash of the run parameters, from hash_settings.
+    """
+    h = hashlib.sha1()
+    if matfile.endswith('.npy'):
+        h.update(eeg_store.fingerprint(matfile).encode())
+    else:
+        h.update(hash_file(matfile).encode())
+    if isinstance(evtfile, str):
+        h.update(hash_file(evtfile).encode())
+    else:
+        h.update(hash_events(evtfile).encode())
+    h.update(repr((str(group), str(age), str(sex), settings)).encode())
+    return h.hexdigest()
+
+
+def write_manifest(export_dir, names, fingerprints):
+    """
+    Writes the fingerprint of each subject in names to export_dir.
+    """
+    df = pd.DataFrame({'SUBJECT': names, 'FINGERPRINT': fingerprints})
+    df.to_csv(os.path.join(export_dir, MANIFEST_FILE), index=False)
+
+
+def read_manifest(run_dir):
+    """
+    Returns a dict mapping each subject in a run's manifest to its
+    fingerprint. Runs made before manifests were written have none, and
+    return an empty dict.
+    """
+    try:
+        df = pd.read_csv(os.path.join(run_dir, MANIFEST_FILE), dtype=str)
+    except OSError:
+        return {}
+    return dict(zip(df.SUBJECT, df.FINGERPRINT))
+
+
+def unchanged_subjects(names, fingerprints, run_dir):
+    """
+    Returns the set of subjects in names whose fingerprint matches the one
+    in the manifest of the previous run at run_dir.
+    """
+    previous = read_manifest(run_dir)
+    return {name for name, fp in zip(names, fingerprints) if previous.get(name) == fp}
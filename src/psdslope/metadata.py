@@ -0,0 +1,68 @@
+"""
+Subject metadata: the auxilliary csv holding each subject's class, age and
+sex, e.g. data/auxilliary/ya-oa-have-files-for-all-conds.csv.
+
+read_metadata validates the csv and indexes it by SUBJECT once, and
+join_recordings matches a list of .mat (or .npy) recordings against it,
+along with the path of each subject's .evt file:
+    >> metadata = read_metadata('data/auxilliary/ya-oa.csv')
+    >> joined, missing = join_recordings(metadata, matfiles, 'data/rs/full/evt/clean/')
+    >> joined.loc['1121181181', 'AGE']
+"""
+
+import os
+
+import pandas as pd
+
+METADATA_COLUMNS = ['SUBJECT', 'CLASS', 'AGE', 'SEX']
+
+
+def read_metadata(path):
+    """
+    Reads the subject csv at path, and returns it as a dataframe indexed by
+    SUBJECT, holding CLASS, AGE and SEX. SUBJECT and CLASS are read as
+    strings, and AGE as integers.
+    Raises ValueError if the csv is missing any of METADATA_COLUMNS, lists
+    a subject more than once, or has a missing or non-integer AGE.
+    """
+    df = pd.read_csv(path, dtype={'SUBJECT': str, 'CLASS': str})
+    missing = [c for c in METADATA_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError('{} is missing columns: {}. Expected columns: {}'.format(
+            path, ', '.join(missing), ', '.join(METADATA_COLUMNS)))
+
+    duplicated = df.SUBJECT[df.SUBJECT.duplicated()].unique()
+    if len(duplicated):
+        raise ValueError('{} lists these subjects more than once: {}'.format(
+            path, ', '.join(duplicated)))
+
+    age = pd.to_numeric(df.AGE, errors='coerce')
+    bad = df.SUBJECT[age.isnull() | (age != age.round())]
+    if len(bad):
+        raise ValueError('{} has a missing or non-integer AGE for subjects: {}'.format(
+            path, ', '.join(bad)))
+    df['AGE'] = age.astype(int)
+    return df[METADATA_COLUMNS].set_index('SUBJECT')
+
+
+def join_recordings(metadata, matfiles, evt_dir):
+    """
+    Joins recordings with their subject metadata in one step.
+    Arguments
+        metadata: Dataframe indexed by SUBJECT, from read_metadata.
+        matfiles: List of paths to .mat or .npy recordings, named
+                  <SUBJECT>.mat or <SUBJECT>.npy.
+        evt_dir:  Directory holding each subject's <SUBJECT>.evt file.
+    Returns
+        joined:  Dataframe indexed by SUBJECT, holding MATFILE, EVTFILE,
+                 CLASS, AGE and SEX for every recording that has metadata,
+                 in the order of matfiles.
+        missing: Subject names of the recordings without metadata.
+    """
+    names = [os.path.splitext(os.path.basename(f))[0] for f in matfiles]
+    files = pd.DataFrame({'MATFILE': matfiles,
+                          'EVTFILE': [os.path.join(evt_dir, name + '.evt') for name in names]},
+                         index=pd.Index(names, name='SUBJECT'))
+    known = files.index.isin(metadata.index)
+    joined = files[known].join(metadata[['CLASS', 'AGE', 'SEX']])
+    return joined, list(files.index[~known])
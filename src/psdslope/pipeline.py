@@ -0,0 +1,570 @@
+"""
+Driver shared by the resting-state and Go-NoGo spectral_slopes.py scripts.
+
+Each script holds only its default parameters and its segment selectors,
+and hands them to run, which imports every subject, computes PSDs over the
+selected segments, fits slopes and writes the results to a new run
+directory. The command-line flags of the parameters both scripts share
+are in FLAGS, and are parsed by get_cmdline_params.
+"""
+
+import os
+import sys
+import zlib
+import glob
+import getopt
+import datetime
+import itertools
+import concurrent.futures
+from collections import OrderedDict
+
+import numpy as np
+
+from .subject import Subject
+from .metadata import read_metadata, join_recordings
+from .results import (run_tables, merge_previous, wide_table, write_tables,
+                      precision_table)
+from .manifest import (hash_settings, input_fingerprint, unchanged_subjects,
+                       write_manifest)
+from .psd_cache import PSDCache
+
+# Command-line flags of the parameters shared by both scripts, in getopt
+# notation. Flags ending in ':' or '=' take a value, which is converted to
+# the type of the parameter's default. The others set the parameter to True.
+FLAGS = OrderedDict([
+    ('m:',            'montage'),
+    ('i:',            'import_dir_mat'),
+    ('e:',            'import_dir_evt'),
+    ('c:',            'import_path_csv'),
+    ('o:',            'export_dir'),
+    ('incremental=',  'incremental'),
+    ('fittingfunc=',  'fitting_func'),
+    ('fittinglo=',    'fitting_lofreq'),
+    ('fittinghi=',    'fitting_hifreq'),
+    ('bufferlo=',     'psd_buffer_lofreq'),
+    ('bufferhi=',     'psd_buffer_hifreq'),
+    ('seed=',         'ransac_seed'),
+    ('sweep',         'sweep'),
+    ('sweepfitting=', 'sweep_fitting'),
+    ('sweepbuffer=',  'sweep_buffer'),
+    ('sweepfuncs=',   'sweep_funcs'),
+    ('precision=',    'psd_precision'),
+    ('precisioncheck', 'precision_check'),
+    ('nperwindow=',   'psd_nperwindow'),
+    ('noverlap=',     'psd_noverlap'),
+    ('taper=',        'psd_window'),
+    ('nfft=',         'psd_nfft'),
+    ('psdchunk=',     'psd_chunk_size'),
+    ('psdthreads=',   'psd_threads'),
+    ('jobs=',         'jobs')
+])
+
+
+def get_filelist(import_path, extension):
+    """
+    Returns list of file paths from import_path with specified extension.
+    """
+    filelist = []
+    for root, dirs, files in os.walk(import_path):
+        filelist += glob.glob(os.path.join(root, '*.' + extension))
+    return filelist
+
+
+def get_sweep_grid(params):
+    """ Returns the grid of (fitting_lofreq, fitting_hifreq,
+    psd_buffer_lofreq, psd_buffer_hifreq, fitting_func) points fitted in
+    sweep mode: every combination of the ranges and fitting functions in
+    params['sweep_fitting'], params['sweep_buffer'] and
+    params['sweep_funcs']. Ranges are given as comma-separated
+    lo-hi pairs, e.g. '2-24,30-45', and functions as e.g. 'linreg,ransac'.
+    """
+    def ranges(arg):
+        return [tuple(int(freq) for freq in r.split('-')) for r in arg.split(',')]
+    return [(fitting_lo, fitting_hi, buffer_lo, buffer_hi, func)
+            for (fitting_lo, fitting_hi), (buffer_lo, buffer_hi), func in itertools.product(
+                ranges(params['sweep_fitting']), ranges(params['sweep_buffer']),
+                params['sweep_funcs'].split(','))]
+
+
+def reference_check(params):
+    """ Returns whether PSDs should also be computed in float64, to check
+    those computed at params['psd_precision'] against.
+    """
+    return params['precision_check'] and params['psd_precision'] != 'float64'
+
+
+def window_seed(params, name):
+    """ Returns the seed of the windows picked from subject name when
+    nwins_upperlimit is set: params['ransac_seed'] along with a hash of the
+    name, so that each subject draws its own windows, and draws the same
+    ones in every run, process and incremental run.
+    """
+    return [params['ransac_seed'], zlib.crc32(str(name).encode())]
+
+
+def process_subject(name, matfile, evtfile, group, age, sex, params, selectors, conditions):
+    """ Imports a single subject, computes per-channel PSDs over the
+    segments chosen by selectors and fits slopes to them. Runs on its own,
+    so that subjects can be processed in parallel.
+    Parameters
+    ----------
+        name : str
+            Subject name, as in the auxilliary csv.
+        matfile : str
+            Path to the subject's .mat file.
+        evtfile : str
+            Path to the subject's processed .evt file.
+        group, age, sex
+            Subject information from the auxilliary csv.
+        params : dict
+            Run parameters, as returned by a script's default_params.
+        selectors : OrderedDict
+            Segment selectors keyed on condition label, see segments.py.
+        conditions : list
+            Labels of the selectors to compute PSDs and fit slopes for.
+            None uses every label.
+    Returns
+    -------
+        Subject object with PSDs and slopes. Its raw EEG data has been
+        cleared, so it's cheap to send back from a worker process.
+    """
+    # Resting-state runs may cut younger adult trials down to the length of
+    # the older adults', and cap the number of windows.
+    modify_trials = params.get('trial_protocol') == 'match_OA' and group == 'DANE'
+    nwins_upperlimit = params.get('nwins_upperlimit', 0)
+    seed = window_seed(params, name) if nwins_upperlimit else None
+    psd_settings = {'nwins_upperlimit': nwins_upperlimit,
+                    'nperwindow': params['psd_nperwindow'], 'noverlap': params['psd_noverlap'],
+                    'window': params['psd_window'], 'nfft': params['psd_nfft'] or None,
+                    'precision': params['psd_precision'], 'reference': reference_check(params),
+                    'chunk_size': params['psd_chunk_size']}
+
+    # Reuse PSDs from the cache if this subject's files, segments and PSD
+    # settings haven't changed since they were computed.
+    subj = None
+    if params.get('psd_cache_dir'):
+        cache = PSDCache(params['psd_cache_dir'], params['psd_cache_mb'] * 2**20)
+        key = cache.key(matfile, evtfile, trial_protocol=params.get('trial_protocol'),
+                        modify_trials=modify_trials,
+                        selectors=[(label, type(s).__name__, sorted(vars(s).items()))
+                                   for label, s in selectors.items()],
+                        conditions=conditions, window_seed=seed, **psd_settings)
+        subj = cache.get(key)
+
+    if subj is None:
+        subj = Subject(matfile, evtfile, group, age, sex, selectors, conditions)
+        print('Processing: {}'.format(subj.name))
+
+        # Modify trial lengths if needed, and compute per-channel PSDs.
+        if modify_trials:
+            subj.modify_trial_length(0, 30)
+        subj.compute_ch_psds(threads=params['psd_threads'],
+                             random_state=np.random.RandomState(seed), **psd_settings)
+        if params.get('psd_cache_dir'):
+            cache.put(key, subj)
+    else:
+        print('Processing: {} (cached PSDs)'.format(subj.name))
+        subj.group, subj.age, subj.sex = group, age, sex
+
+    # Fit line to PSD slopes using specified fitting function across
+    # specified fitting range with specified exclusion buffer.
+    # In sweep mode, fit every point of the grid to the same PSDs instead.
+    if params['sweep']:
+        subj.sweep_slopes(get_sweep_grid(params), params['ransac_seed'])
+    else:
+        subj.fit_slopes(params['fitting_func'], params['psd_buffer_lofreq'],
+                        params['psd_buffer_hifreq'], params['fitting_lofreq'],
+                        params['fitting_hifreq'], params['ransac_seed'])
+
+    # Compare the PSDs and slopes against the float64 reference.
+    if subj.reference_psds:
+        subj.precision_errors = subj.precision_error(
+            params['fitting_func'], params['psd_buffer_lofreq'], params['psd_buffer_hifreq'],
+            params['fitting_lofreq'], params['fitting_hifreq'], params['ransac_seed'])
+        for cond, (psd_diff, slope_diff) in subj.precision_errors.items():
+            print('{} {}: {} PSDs differ from float64 by at most {:.3g} (relative), '
+                  'slopes by at most {:.3g}'.format(subj.name, cond, subj.precision,
+                                                     psd_diff, slope_diff))
+    print('Done: {}'.format(subj.name))
+    return subj
+
+
+def make_export_dir(params, analysis_tag):
+    """ Creates directory into which we'll save the outputs of the
+    analysis.
+
+    Since the same analysis is often run multiple times while
+    the script is tweaked, make_export_dir appends the run number at
+    the end of the directory name in order to avoid overwriting results
+    from a run done previously on the same day. An example of what the
+    created directory will look like:
+        2017-05-20-rs-sensor-level/
+    Parameters
+    ----------
+        params : dict
+            Dictionary containing at least the following keys:
+            'export_dir' : str
+                Absolute path to the export directory
+            'time' : str
+                String generated through the following code:
+                    str(datetime.datetime.now()).split()[0]
+            'montage' : str
+                Montage that we're running. e.g., 'sensor-level', or
+                'dmn' for default mode network.
+        analysis_tag : str
+            Analysis the run belongs to, 'rs' or 'gng'.
+    """
+    export_dir_name = (
+        params['export_dir'] + '/' + params['time'] + '-' + analysis_tag + '-' +
+        params['montage'] + '/'
+    )
+    num = 1
+    while os.path.isdir(export_dir_name):
+        export_dir_name = params['export_dir'] + '/' + params['time'] + '-' + analysis_tag +\
+                          '-' + params['montage'] + '-' + str(num) + '/'
+        num += 1
+    params['export_dir'] = export_dir_name
+    os.mkdir(params['export_dir'])
+
+    # Write parameters to terminal and to parameters.txt.
+    with open(params['export_dir'] + 'parameters.txt', 'w') as params_file:
+        print()
+        for p in params:
+            line = ' {}: {}'.format(p, str(params[p]))
+            print(line)
+            params_file.write(line + '\n')
+        print()
+    return params
+
+
+def get_cmdline_params(params, argv=None, usage='', flags=None):
+    """ Fetches command-line parameters.
+    Parameters
+    ----------
+        params : dict
+            Dictionary into which we'll place command-line params.
+        argv : list
+            Command-line arguments, including the script name. Defaults
+            to sys.argv.
+        usage : str
+            How to run the script, printed with -h or bad input.
+        flags : dict
+            The script's own flags, in addition to FLAGS, mapped to the
+            parameters they set.
+    """
+    argv = sys.argv if argv is None else argv
+    flags = OrderedDict(list(FLAGS.items()) + list((flags or {}).items()))
+    shortopts = 'h' + ''.join(f for f in flags if len(f.rstrip(':')) == 1)
+    longopts = [f for f in flags if len(f.rstrip(':')) > 1]
+    try:
+        opts, args = getopt.getopt(argv[1:], shortopts, longopts)
+    except getopt.GetoptError:
+        print('Error: Bad input. To run:\n')
+        print(usage)
+        print('Or, manually modify program parameters and run without command-line args.')
+        sys.exit(2)
+    params_of = {'-' * (1 + (len(f.rstrip(':=')) > 1)) + f.rstrip(':='): key
+                 for f, key in flags.items()}
+    for opt, arg in opts:
+        if opt == '-h':
+            print('Help:\n')
+            print(usage)
+            print('Or, manually modify program parameters and run without command-line args.')
+            sys.exit(2)
+        key = params_of[opt]
+        if isinstance(params[key], bool):
+            params[key] = True
+        else:
+            params[key] = type(params[key])(arg)
+    return params
+
+
+def default_params():
+    """
+    Returns the run parameters shared by both analyses, along with the date
+    and commit of the run. The scripts' default_params add their own.
+
+    Parameters : Change these before running, or change them through
+    the command-line flags.
+    ----------
+    montage : string
+        Command-line flag: -m
+        montage we're running spectral_slopes on. Options are:
+            'dmn': Default mode network source model.
+            'frontal': Frontal source model.
+            'dorsal': Dorsal attention source model.
+            'ventral': Ventral attention source model.
+            'sensor-level': For running the original sensor-level data.
+    psd_buffer_lofreq : float
+        Command-line flag: --bufferlo=
+        lower frequency bound for the PSD buffer we exclude from fitting.
+    psd_buffer_hifreq : float
+        Command-line flag: --bufferhi=
+        upper frequency bound for the PSD buffer we exclude from fitting.
+    fitting_func : string
+        Command-line flag: --fittingfunc=
+        function we use for fitting to the PSDs. Options are:
+            'linreg': Simple linear regression.
+            'ransac': RANSAC, a robust fitting method.
+    fitting_lofreq : float
+        Command-line flag: --fittinglo=
+        lower frequency bound for the PSD fitting.
+    fitting_hifreq : float
+        Command-line flag: --fittinghi=
+        higher frequency bound for the PSD fitting.
+    ransac_seed : int
+        Command-line flag: --seed=
+        seed for RANSAC's random sampling, so that reruns produce the
+        same slopes. Along with each subject's name, also seeds the
+        windows picked under nwins_upperlimit, see window_seed.
+    sweep : bool
+        Command-line flag: --sweep
+        fit every combination of the sweep_* parameters below to PSDs
+        computed once per subject, rather than the single fit given by
+        the fitting and buffer parameters above. The slopes are written
+        to a single sweep/ dataset, keyed by each grid point's
+        parameters, in place of the .csv, slopes/ and psds/ outputs.
+    sweep_fitting : string
+        Command-line flag: --sweepfitting=
+        fitting ranges to sweep, as comma-separated lo-hi pairs.
+    sweep_buffer : string
+        Command-line flag: --sweepbuffer=
+        PSD buffers to sweep, as comma-separated lo-hi pairs. 0-0
+        excludes no buffer.
+    sweep_funcs : string
+        Command-line flag: --sweepfuncs=
+        comma-separated fitting functions to sweep.
+    psd_nperwindow : int
+        Command-line flag: --nperwindow=
+        length of the windows PSDs are computed from, in time-points.
+        1024 is 2 seconds at 512 Hz, giving 0.5 Hz frequency resolution.
+    psd_noverlap : int
+        Command-line flag: --noverlap=
+        time-points by which consecutive windows overlap, less than
+        psd_nperwindow. More overlap averages more windows.
+    psd_window : string
+        Command-line flag: --taper=
+        taper applied to each window. Options are:
+            'hamming', 'hann': Or any other scipy.signal window.
+            'dpss': Multitaper estimate, averaging over the 2*NW - 1
+            Slepian tapers of time-halfbandwidth NW = 3. 'dpss:4' sets
+            NW = 4.
+    psd_nfft : int
+        Command-line flag: --nfft=
+        length of the FFT, zero-padding each window. 0 uses
+        psd_nperwindow. The frequencies of the PSDs, and of the fitting
+        and buffer ranges, follow from the sampling rate and nfft.
+    psd_precision : string
+        Command-line flag: --precision=
+        precision in which windows are cut, tapered and Fourier
+        transformed. Options are:
+            'float64': Double precision, the reference.
+            'float32': Single precision, halving the memory and bandwidth
+            taken by the windows. Power is still averaged, and slopes
+            fitted, in double precision.
+    precision_check : bool
+        Command-line flag: --precisioncheck
+        also computes float64 PSDs from the same windows when
+        psd_precision isn't 'float64', and reports how far the PSDs and
+        slopes are from them, per subject and condition, in
+        precision.csv. Changing it recomputes every subject of an
+        incremental run, so that precision.csv covers them all.
+    psd_chunk_size : int
+        Command-line flag: --psdchunk=
+        number of samples of the recording to read at a time when
+        computing PSDs. Each chunk's windows are added to running sums of
+        periodograms, so peak memory depends on the chunk size rather
+        than the length of the recording. Use with .npy recordings from
+        psdslope.eeg_store, which are read from disk as needed. A value
+        of 0 reads every window at once.
+    psd_threads : int
+        Command-line flag: --psdthreads=
+        number of threads each subject's PSDs are computed with, over
+        blocks of channels. Gives the same PSDs as a single thread. Useful
+        with jobs = 1, e.g. on nodes without the memory for a process per
+        subject.
+    import_path_csv : string
+        Command-line flag: -c
+        csv file holding SUBJECT, CLASS, AGE and SEX for each subject.
+    import_dir_mat : string
+        Command-line flag: -i
+        directory from which we import .mat EEG files, or .npy files
+        converted from them by psdslope.eeg_store.
+    import_dir_evt : string
+        Command-line flag: -e
+        directory from which we import .evt event files.
+    export_dir : string
+        Command-line flag: -o
+        directory to which we export the results, as a .csv file.
+    incremental : string
+        Command-line flag: --incremental=
+        directory of a previous run, e.g. data/runs/2017-05-20-rs-dmn/.
+        Subjects whose .mat and .evt files, csv information and run
+        parameters haven't changed since that run are copied from its
+        results, and only new or changed subjects are computed. Every run
+        records these in its manifest.csv. An empty string computes every
+        subject.
+    jobs : int
+        Command-line flag: --jobs=
+        number of worker processes used to process subjects in parallel.
+        A value of 1 processes subjects one at a time.
+    """
+
+    params = OrderedDict()
+    params['montage']           = 'sensor-level'
+    params['psd_buffer_lofreq'] = 7
+    params['psd_buffer_hifreq'] = 14
+    params['fitting_func']      = 'ransac'
+    params['fitting_lofreq']    = 2
+    params['fitting_hifreq']    = 24
+    params['ransac_seed']       = 0
+    params['sweep']             = False
+    params['sweep_fitting']     = '2-24,2-45,30-45'
+    params['sweep_buffer']      = '7-14,0-0'
+    params['sweep_funcs']       = 'linreg,ransac'
+    params['psd_nperwindow']    = 512*2
+    params['psd_noverlap']      = 512
+    params['psd_window']        = 'hamming'
+    params['psd_nfft']          = 0
+    params['psd_precision']     = 'float64'
+    params['precision_check']   = False
+    params['psd_chunk_size']    = 0
+    params['psd_threads']       = 1
+    params['import_path_csv']   = ''
+    params['import_dir_mat']    = ''
+    params['import_dir_evt']    = ''
+    params['export_dir']        = 'data/runs/'
+    params['incremental']       = ''
+    params['jobs']              = 1
+
+    ###########################################################################
+
+    # Generate information about current run.
+    params['time'] = str(datetime.datetime.now()).split()[0]
+    with open('.git/refs/heads/master', 'r') as f:
+        params['commit'] = f.read()[0:7]
+    params.move_to_end('commit', last=False)
+    params.move_to_end('time', last=False)
+
+    return params
+
+
+def run(params, selectors, analysis_tag, events=None, conditions=None, csv_prefix=None):
+    """ Runs the analysis with the given parameters, as returned by a
+    script's default_params. Creates the run directory, computes PSDs, fits
+    slopes and writes the results, returning the list of Subject objects
+    that were computed, i.e. excluding those reused in incremental mode.
+    Parameters
+    ----------
+        params : dict
+            Run parameters. params['export_dir'] is updated to the
+            directory created for this run.
+        selectors : OrderedDict
+            Segment selectors keyed on condition label, see segments.py.
+        analysis_tag : str
+            Analysis the run belongs to, 'rs' or 'gng', used to name the
+            run directory.
+        events : dict
+            Processed events of each subject as dataframes, keyed on
+            subject name, e.g. straight from the preprocessing stage.
+            Subjects missing from events, or every subject if events
+            is None, are read from import_dir_evt.
+        conditions : list
+            Labels of the selectors to compute PSDs and fit slopes for,
+            e.g. leaving out those only used to modify trials. None uses
+            every label.
+        csv_prefix : str
+            Prefix of the results .csv, e.g. 'rs-full'. Defaults to
+            analysis_tag.
+    """
+    # Make a directory for this run and write parameters to terminal and file.
+    params = make_export_dir(params, analysis_tag)
+
+    ##########################################################################
+    # Compute PSDs and fit to slopes.
+
+    # Import subject class, age and sex from auxilliary csv, and join them
+    # with each subject's .mat and .evt files.
+    matfiles = sorted(get_filelist(params['import_dir_mat'], 'mat') +
+                      get_filelist(params['import_dir_mat'], 'npy'))
+    metadata = read_metadata(params['import_path_csv'])
+    joined, missing = join_recordings(metadata, matfiles, params['import_dir_evt'])
+
+    # Check whether we're missing any subject information (i.e., we have the
+    # subject EEG, but they're not present in the .csv).
+    for name in missing:
+        print('NOTE: Specified csv does not contain information for subject {}'.format(name))
+    if len(missing) > 0:
+        print('To include the above subjects, add their information to the .csv file.\n')
+
+    # Import EEG data for each subject, compute PSDs and fit slopes. With
+    # jobs > 1 subjects are farmed out to a process pool; results come back
+    # in the same (sorted) order as matfiles either way.
+    subj_names = list(joined.index)
+    matfiles = list(joined.MATFILE)
+    events = events or {}
+    evtfiles = [events.get(name, evtfile) for name, evtfile in zip(subj_names, joined.EVTFILE)]
+    groups = list(joined.CLASS)
+    ages   = list(joined.AGE)
+    sexes  = list(joined.SEX)
+
+    # Fingerprint each subject's inputs. In incremental mode, subjects whose
+    # fingerprint matches the manifest of the previous run are copied from
+    # its results rather than recomputed.
+    settings = hash_settings(params)
+    fingerprints = [input_fingerprint(*inputs, settings)
+                    for inputs in zip(matfiles, evtfiles, groups, ages, sexes)]
+    reused = set()
+    if params['incremental']:
+        reused = unchanged_subjects(subj_names, fingerprints, params['incremental'])
+        print('Reusing results of {} of {} subjects from {}'.format(
+            len(reused), len(subj_names), params['incremental']))
+    todo = [i for i, name in enumerate(subj_names) if name not in reused]
+
+    args = ([subj_names[i] for i in todo], [matfiles[i] for i in todo],
+            [evtfiles[i] for i in todo], [groups[i] for i in todo],
+            [ages[i] for i in todo], [sexes[i] for i in todo],
+            itertools.repeat(params), itertools.repeat(selectors), itertools.repeat(conditions))
+    if params['jobs'] > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=params['jobs']) as pool:
+            results = list(pool.map(process_subject, *args))
+    else:
+        results = list(map(process_subject, *args))
+
+    ##########################################################################
+    # Export results to .csv file, save all slopes/PSDs to disk.
+
+    # Long-format tables of the slopes, PSDs and fit lines of every subject,
+    # channel and condition, or of every grid point in sweep mode.
+    tables = run_tables(results, params['montage'], params['sweep'])
+    if reused:
+        tables = merge_previous(tables, params['montage'], params['incremental'],
+                                reused, subj_names)
+
+    # Export fitted slopes to file directory, with one row per subject.
+    if not params['sweep']:
+        filename = (params['export_dir'] + (csv_prefix or analysis_tag) + '-' +
+                    params['montage'] + '-' + params['fitting_func'] + '-' +
+                    str(params['fitting_lofreq']) + '-' + str(params['fitting_hifreq']) + '.csv')
+        print('Saving fitted slopes at:\n', filename)
+        wide_table(tables['slopes']).to_csv(filename, index=False)
+
+    # Write every table to a long-format Parquet dataset, partitioned by
+    # montage.
+    paths = write_tables(tables, params['export_dir'])
+    print('Saving results at:\n', '\n '.join(paths))
+
+    # Export the difference of each subject's PSDs and slopes from the
+    # float64 reference.
+    precision = precision_table(results)
+    if len(precision):
+        filename = params['export_dir'] + 'precision.csv'
+        print('Saving precision check at:\n', filename)
+        print('Largest relative PSD difference: {:.3g}, largest slope difference: {:.3g}'.format(
+            precision.PSD_MAX_RELDIFF.max(), precision.SLOPE_MAX_ABSDIFF.max()))
+        precision.to_csv(filename, index=False)
+
+    # The manifest goes last, so that a run interrupted while writing its
+    # results has none, and later incremental runs don't reuse from it.
+    write_manifest(params['export_dir'], subj_names, fingerprints)
+    return results
@@ -0,0 +1,115 @@
+"""
+On-disk cache of computed subject PSDs.
+
+Entries are addressed by a hash of the subject's .mat and .evt files
+together with every setting that affects the PSDs, so changing only the
+fitting parameters reuses the PSDs from a previous run. The cache is kept
+under a maximum size by evicting the least recently used entries.
+"""
+
+import os
+import glob
+import pickle
+import hashlib
+import tempfile
+
+from . import eeg_store
+from .manifest import hash_file, hash_events
+
+# Bump whenever the layout of cached Subject objects changes.
+CACHE_VERSION = 6
+
+
+class PSDCache:
+
+    def __init__(self, cache_dir, max_bytes=2*2**30):
+        """
+        Arguments
+            cache_dir: Directory in which to store entries. Created if it
+                       doesn't exist.
+            max_bytes: Maximum total size of the cache, in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def key(self, matfile, evtfile, **settings):
+        """
+        Returns the key for a subject's PSDs, computed from the contents of
+        matfile and evtfile and the given settings (e.g. trial_protocol,
+        nwins_upperlimit, window length and overlap). For recordings
+        converted by psdslope.eeg_store, the data hash in the sidecar is used
+        instead of reading the whole .npy file. evtfile may also be an
+        events dataframe, see hash_events.
+        """
+        h = hashlib.sha1()
+        if matfile.endswith('.npy'):
+            h.update(eeg_store.fingerprint(matfile).encode())
+        else:
+            h.update(hash_file(matfile).encode())
+        if isinstance(evtfile, str):
+            h.update(hash_file(evtfile).encode())
+        else:
+            h.update(hash_events(evtfile).encode())
+        settings['cache_version'] = CACHE_VERSION
+        h.update(repr(sorted(settings.items())).encode())
+        return h.hexdigest()
+
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+
+    def get(self, key):
+        """
+        Returns the object stored under key, or None if there isn't one.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                obj = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # Mark the entry as recently used.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return obj
+
+
+    def put(self, key, obj):
+        """
+        Stores obj under key, then evicts old entries if the cache has grown
+        past max_bytes.
+        """
+        # Write to a temporary file first so that concurrent workers never
+        # read a partially written entry.
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+        self._evict()
+
+
+    def _evict(self):
+        """
+        Deletes least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.pkl')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,501 @@
+"""
+Long-format, columnar results of a spectral slopes run. Results are
+written as Parquet datasets inside of the run's export directory, each
+partitioned by montage:
+
+    slopes/MONTAGE=<montage>/  One row per subject, channel and condition:
+        SUBJECT, CLASS, AGE, SEX, CHANNEL, CONDITION, NWINDOWS, SLOPE,
+        SLOPE_SE
+    psds/MONTAGE=<montage>/    One row per subject, channel, condition and
+                               frequency:
+        SUBJECT, CHANNEL, CONDITION, FREQUENCY, POWER, FIT, LOG_POWER_SE
+    sweep/MONTAGE=<montage>/   Sweep runs only. One row per grid point,
+                               subject, channel and condition:
+        FITTING_LOFREQ, FITTING_HIFREQ, BUFFER_LOFREQ, BUFFER_HIFREQ,
+        FITTING_FUNC, followed by the slopes columns
+
+POWER is the PSD, and FIT is the fitted line in log10(power).
+LOG_POWER_SE is the standard error of log10(POWER), the values lines are
+fitted to, from the variance of the windows' PSDs by the delta method:
+    LOG_POWER_SE = sqrt(var / n_eff) / (POWER * ln(10))
+n_eff counts the windows as if independent, discounting the correlation
+of overlapping windows (about 0.9 of NWINDOWS for Hamming windows
+overlapping by half, see spectral.effective_count). SLOPE_SE is the
+standard error of the slope propagated from LOG_POWER_SE, over the points
+the line was fitted to, and allowing for the correlation between
+neighbouring frequencies due to the taper and zero-padding (see
+fitting.linreg_stderr). For RANSAC, those points are the inliers, and
+SLOPE_SE leaves out the variability of choosing them, so it understates
+the spread of RANSAC slopes; it's best read as a lower bound. Runs that
+check a reduced PSD precision against the float64 reference also write
+precision.csv, see precision_table. Single columns, or the rows matching a
+filter, can be read without loading the rest of a run, e.g.:
+    >> pd.read_parquet(run_dir + 'slopes', columns=['SUBJECT', 'CHANNEL', 'SLOPE'])
+    >> pd.read_parquet(run_dir + 'psds', filters=[('CHANNEL', '==', 'PCC')])
+    >> pd.read_parquet(run_dir + 'sweep', filters=[('FITTING_FUNC', '==', 'ransac')])
+
+read_slopes and read_psds do the same across many runs at once, using each
+run's parameters.txt to skip runs that don't match before any results are
+read, e.g. the eyes-closed slopes of older adults over every 2-24Hz run:
+    >> runs = find_runs('data/runs/', fitting_lofreq=2, fitting_hifreq=24)
+    >> read_slopes(runs, conditions=['eyesc'], min_age=60)
+Older runs which only hold the wide .csv are read from it instead, parsing
+just the columns that were asked for.
+
+Reading and writing Parquet requires pyarrow.
+"""
+
+import os
+import glob
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .manifest import MANIFEST_FILE
+
+SLOPES_COLUMNS = ['SUBJECT', 'CLASS', 'AGE', 'SEX', 'CHANNEL', 'CONDITION',
+                  'NWINDOWS', 'SLOPE', 'SLOPE_SE']
+PSDS_COLUMNS = ['SUBJECT', 'CHANNEL', 'CONDITION', 'FREQUENCY', 'POWER', 'FIT',
+                'LOG_POWER_SE']
+# Parameters keying each grid point of a sweep, in the order of the tuples
+# passed to Subject.sweep_slopes.
+GRID_COLUMNS = ['FITTING_LOFREQ', 'FITTING_HIFREQ', 'BUFFER_LOFREQ', 'BUFFER_HIFREQ',
+                'FITTING_FUNC']
+SWEEP_COLUMNS = GRID_COLUMNS + SLOPES_COLUMNS
+PRECISION_COLUMNS = ['SUBJECT', 'CONDITION', 'PRECISION', 'PSD_MAX_RELDIFF',
+                     'SLOPE_MAX_ABSDIFF']
+
+
+def slopes_table(subjects, montage):
+    """
+    Returns the slopes of every subject, channel and condition as a
+    long-format dataframe with SLOPES_COLUMNS and MONTAGE.
+    Arguments
+        subjects: List of Subject objects, after fit_slopes has been run.
+        montage:  Montage the subjects were run on, e.g. 'sensor-level'.
+    """
+    tables = []
+    for s in subjects:
+        chans, conds = np.meshgrid(np.arange(s.nbchan), np.arange(len(s.conditions)),
+                                   indexing='ij')
+        chans, conds = chans.ravel(), conds.ravel()
+        tables.append(pd.DataFrame({
+            'SUBJECT':   s.name,
+            'CLASS':     s.group,
+            'AGE':       s.age,
+            'SEX':       s.sex,
+            'CHANNEL':   np.asarray(s.chans)[chans],
+            'CONDITION': np.asarray(s.conditions)[conds],
+            'NWINDOWS':  [getattr(s, 'nwins_' + s.conditions[c]) for c in conds],
+            'SLOPE':     [s.psds[ch][s.conditions[c] + '_slope'][0] for ch, c in zip(chans, conds)],
+            'SLOPE_SE':  [s.psds[ch][s.conditions[c] + '_slope_stderr'][0]
+                          for ch, c in zip(chans, conds)]
+        }))
+    df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=SLOPES_COLUMNS)
+    df['MONTAGE'] = montage
+    return df
+
+
+def psds_table(subjects, montage):
+    """
+    Returns the PSD and fitted line of every subject, channel and condition
+    as a long-format dataframe with PSDS_COLUMNS and MONTAGE, with one row
+    per frequency. The fit lines are straight in log10(power), so they're
+    evaluated over the frequencies of the alpha buffer too.
+    Arguments
+        subjects: List of Subject objects, after fit_slopes has been run.
+        montage:  Montage the subjects were run on, e.g. 'sensor-level'.
+    """
+    tables = []
+    for s in subjects:
+        f = np.ravel(s.f)
+        f_fit = np.ravel(s.f_rm_alpha)
+        keys = [(ch, cond) for ch in range(s.nbchan) for cond in s.conditions]
+        power = np.array([np.ravel(s.psds[ch][cond]) for ch, cond in keys])
+        fit = np.array([np.interp(f, f_fit, np.ravel(s.psds[ch][cond + '_fitline']))
+                        for ch, cond in keys])
+        stderr = np.array([np.ravel(s.psds[ch][cond + '_stderr']) for ch, cond in keys])
+        tables.append(pd.DataFrame({
+            'SUBJECT':   s.name,
+            'CHANNEL':   np.repeat([s.chans[ch] for ch, _ in keys], len(f)),
+            'CONDITION': np.repeat([cond for _, cond in keys], len(f)),
+            'FREQUENCY': np.tile(f, len(keys)),
+            'POWER':     power.ravel(),
+            'FIT':       fit.ravel(),
+            'LOG_POWER_SE': stderr.ravel()
+        }))
+    df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=PSDS_COLUMNS)
+    df['MONTAGE'] = montage
+    return df
+
+
+def sweep_table(subjects, montage):
+    """
+    Returns the slopes of every grid point, subject, channel and condition
+    of a sweep as a long-format dataframe with SWEEP_COLUMNS and MONTAGE,
+    keyed by the grid point's parameters.
+    Arguments
+        subjects: List of Subject objects, after sweep_slopes has been run.
+        montage:  Montage the subjects were run on, e.g. 'sensor-level'.
+    """
+    tables = []
+    for s in subjects:
+        points, chans, conds = np.meshgrid(np.arange(len(s.grid)), np.arange(s.nbchan),
+                                           np.arange(len(s.conditions)), indexing='ij')
+        points, chans, conds = points.ravel(), chans.ravel(), conds.ravel()
+        table = pd.DataFrame(np.asarray(s.grid, dtype=object)[points], columns=GRID_COLUMNS)
+        table = table.astype({c: int for c in GRID_COLUMNS[:-1]})
+        table['SUBJECT']   = s.name
+        table['CLASS']     = s.group
+        table['AGE']       = s.age
+        table['SEX']       = s.sex
+        table['CHANNEL']   = np.asarray(s.chans)[chans]
+        table['CONDITION'] = np.asarray(s.conditions)[conds]
+        table['NWINDOWS']  = [getattr(s, 'nwins_' + s.conditions[c]) for c in conds]
+        table['SLOPE']     = s.grid_slopes.ravel()
+        table['SLOPE_SE']  = s.grid_stderrs.ravel()
+        tables.append(table)
+    df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=SWEEP_COLUMNS)
+    df['MONTAGE'] = montage
+    return df
+
+
+def run_tables(subjects, montage, sweep=False):
+    """
+    Returns the datasets of a run as an OrderedDict of dataframes, keyed on
+    dataset name: slopes and psds, or sweep for sweep runs.
+    """
+    if sweep:
+        return OrderedDict([('sweep', sweep_table(subjects, montage))])
+    return OrderedDict([('slopes', slopes_table(subjects, montage)),
+                        ('psds', psds_table(subjects, montage))])
+
+
+def merge_previous(tables, montage, run_dir, reused, order):
+    """
+    Adds the rows of the subjects in reused, read from the datasets of the
+    previous run at run_dir, to each of tables (see run_tables). Rows are
+    then sorted into the order of the subject names in order, keeping each
+    subject's rows in their original order.
+    """
+    merged = OrderedDict()
+    rank = {name: i for i, name in enumerate(order)}
+    for name, table in tables.items():
+        previous = pd.read_parquet(os.path.join(run_dir, name),
+                                   filters=[('MONTAGE', '==', montage),
+                                            ('SUBJECT', 'in', sorted(reused))])
+        previous = previous[list(table.columns)]
+        for column in previous.columns:
+            if isinstance(previous[column].dtype, pd.CategoricalDtype):
+                previous[column] = previous[column].astype(str)
+        df = pd.concat([df for df in [table, previous] if len(df)] or [table],
+                       ignore_index=True)
+        df = df.iloc[np.argsort(df.SUBJECT.map(rank).values, kind='stable')]
+        merged[name] = df.reset_index(drop=True)
+    return merged
+
+
+def wide_table(slopes):
+    """
+    Returns a slopes table in the wide format of the results .csv, with one
+    row per subject: SUBJECT, CLASS, AGE, then NWINDOWS_<CONDITION> for each
+    condition, then <CHANNEL>_<CONDITION> for each condition and channel.
+    """
+    subjects = pd.unique(slopes.SUBJECT)
+    chans = pd.unique(slopes.CHANNEL)
+    conds = pd.unique(slopes.CONDITION)
+    first = slopes.drop_duplicates('SUBJECT').set_index('SUBJECT').loc[subjects]
+    df = pd.DataFrame({'SUBJECT': subjects,
+                       'CLASS':   first.CLASS.values,
+                       'AGE':     first.AGE.values})
+    nwins = (slopes.drop_duplicates(['SUBJECT', 'CONDITION'])
+                   .pivot(index='SUBJECT', columns='CONDITION', values='NWINDOWS'))
+    for cond in conds:
+        df['NWINDOWS_' + cond.upper()] = nwins.loc[subjects, cond].values
+    slope = slopes.pivot(index='SUBJECT', columns=['CONDITION', 'CHANNEL'], values='SLOPE')
+    for cond in conds:
+        for chan in chans:
+            df[chan + '_' + cond.upper()] = slope.loc[subjects, (cond, chan)].values
+    return df
+
+
+def write_tables(tables, export_dir):
+    """
+    Writes each of tables (see run_tables) to a Parquet dataset of the same
+    name in export_dir, partitioned by montage. Returns the paths of the
+    datasets.
+    """
+    paths = []
+    for name, table in tables.items():
+        table = table.copy()
+        for column in ['SUBJECT', 'CLASS', 'CHANNEL', 'CONDITION', 'FITTING_FUNC']:
+            if column in table.columns:
+                table[column] = table[column].astype(str).astype('category')
+        path = os.path.join(export_dir, name)
+        table.to_parquet(path, engine='pyarrow', partition_cols=['MONTAGE'], index=False,
+                         basename_template='part-{i}.parquet')
+        paths.append(path)
+    return paths
+
+
+def precision_table(subjects):
+    """
+    Returns, for every subject and condition, the largest relative
+    difference of its PSDs and the largest absolute difference of its
+    slopes (x 10^2) from the float64 reference, as a dataframe with
+    PRECISION_COLUMNS. Only subjects with a precision_errors attribute,
+    as returned by Subject.precision_error, are included.
+    """
+    rows = [(s.name, cond, s.precision, psd_diff, slope_diff)
+            for s in subjects if getattr(s, 'precision_errors', None)
+            for cond, (psd_diff, slope_diff) in s.precision_errors.items()]
+    return pd.DataFrame(rows, columns=PRECISION_COLUMNS)
+
+
+def write_results(subjects, montage, export_dir, sweep=False):
+    """
+    Writes the datasets of a run into export_dir, each partitioned by
+    montage. Returns the paths of the datasets.
+    """
+    return write_tables(run_tables(subjects, montage, sweep), export_dir)
+
+
+## Reading ####################################################################
+
+# Run parameters attached to every row read by read_slopes and read_psds.
+RUN_COLUMNS = ['RUN', 'FITTING_FUNC', 'FITTING_LOFREQ', 'FITTING_HIFREQ', 'BUFFER_LOFREQ',
+               'BUFFER_HIFREQ', 'PRECISION']
+
+
+def read_parameters(run_dir):
+    """
+    Returns the parameters a run was made with, read from its
+    parameters.txt, as a dict of strings.
+    """
+    params = {}
+    with open(os.path.join(run_dir, 'parameters.txt')) as f:
+        for line in f:
+            key, sep, value = line.strip().partition(': ')
+            if sep:
+                params[key] = value
+    return params
+
+
+def find_runs(runs_dir='data/runs/', analysis='rs', montages=None, sweep=False, **params):
+    """
+    Returns the run directories in runs_dir, e.g. data/runs/<date>-rs-<montage>/,
+    made with the given parameters. Only each run's parameters.txt is read.
+    Arguments
+        analysis: 'rs' or 'gng'.
+        montages: List of montages to keep. None keeps every montage.
+        sweep:    False keeps only regular runs, which read_slopes and
+                  read_psds read. True keeps only sweep runs, whose results
+                  are in their sweep dataset. None keeps both.
+        params:   Parameters the runs must have been made with, compared to
+                  parameters.txt as strings, e.g. fitting_lofreq=2.
+    For example, every RANSAC run over 2-24Hz of the DMN and frontal models:
+        >> find_runs(montages=['dmn', 'frontal'], fitting_func='ransac',
+                     fitting_lofreq=2, fitting_hifreq=24)
+    """
+    runs = []
+    for run_dir in sorted(glob.glob(os.path.join(runs_dir, '*-' + analysis + '-*', ''))):
+        try:
+            run_params = read_parameters(run_dir)
+        except OSError:
+            continue
+        if montages is not None and run_params.get('montage') not in montages:
+            continue
+        if sweep is not None and run_params.get('sweep', 'False') != str(sweep):
+            continue
+        if all(run_params.get(key) == str(value) for key, value in params.items()):
+            runs.append(run_dir)
+    return runs
+
+
+def _isin(column, values):
+    import pyarrow.dataset as ds
+    return ds.field(column).isin([str(v) for v in values])
+
+
+def _read_dataset(path, columns, filters):
+    """
+    Reads columns of the Parquet dataset at path, keeping only the rows that
+    match every expression in filters. Filters on MONTAGE skip whole
+    partitions, and the rest are applied while scanning.
+    """
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    expr = None
+    for f in filters:
+        expr = f if expr is None else expr & f
+    found = [c for c in columns if c in dataset.schema.names]
+    # Columns older runs never had, e.g. SLOPE_SE, are left empty.
+    return dataset.to_table(columns=found, filter=expr).to_pandas().reindex(columns=columns)
+
+
+def _results_csvs(run_dir):
+    """
+    Returns the paths of a run's wide results .csv files.
+    """
+    return sorted(f for f in glob.glob(os.path.join(run_dir, '*.csv'))
+                  if os.path.basename(f) != MANIFEST_FILE)
+
+
+def _read_wide_csv(run_dir, columns, subjects, channels, conditions, classes,
+                   min_age, max_age):
+    """
+    Reads the slopes of a run that has no slopes dataset from its wide .csv,
+    parsing only the columns needed, and returns them in long format.
+    """
+    csvfile = _results_csvs(run_dir)[0]
+    header = pd.read_csv(csvfile, nrows=0).columns
+    info = [c for c in ['SUBJECT', 'CLASS', 'AGE', 'SEX'] if c in header]
+    slope_cols = []
+    for c in header:
+        chan, _, cond = c.rpartition('_')
+        if c in info or c.startswith('NWINDOWS_') or not chan:
+            continue
+        if channels is not None and chan not in channels:
+            continue
+        if conditions is not None and cond.lower() not in conditions:
+            continue
+        slope_cols.append(c)
+    nwins = [c for c in header if c.startswith('NWINDOWS_')]
+    wide = pd.read_csv(csvfile, usecols=info + nwins + slope_cols)
+    wide.SUBJECT = wide.SUBJECT.astype(str)
+    wide = wide[_info_mask(wide, subjects, classes, min_age, max_age)]
+
+    df = wide.melt(id_vars=info + nwins, value_vars=slope_cols, value_name='SLOPE')
+    df['CHANNEL'] = df.variable.str.rpartition('_')[0]
+    df['CONDITION'] = df.variable.str.rpartition('_')[2].str.lower()
+    df['NWINDOWS'] = 0
+    for c in nwins:
+        rows = df.CONDITION == c[len('NWINDOWS_'):].lower()
+        df.loc[rows, 'NWINDOWS'] = df.loc[rows, c]
+    df['MONTAGE'] = read_parameters(run_dir).get('montage')
+    # Columns the .csv never had, e.g. SEX, are left empty.
+    return df.reindex(columns=columns)
+
+
+def _info_mask(df, subjects, classes, min_age, max_age):
+    mask = np.ones(len(df), dtype=bool)
+    if subjects is not None:
+        mask &= df.SUBJECT.astype(str).isin([str(s) for s in subjects]).values
+    if classes is not None:
+        mask &= df.CLASS.astype(str).isin([str(c) for c in classes]).values
+    if min_age is not None:
+        mask &= (df.AGE >= min_age).values
+    if max_age is not None:
+        mask &= (df.AGE <= max_age).values
+    return mask
+
+
+def _add_run_columns(df, run_dir):
+    params = read_parameters(run_dir)
+    df.insert(0, 'RUN', os.path.basename(os.path.normpath(run_dir)))
+    df.insert(1, 'FITTING_FUNC', params.get('fitting_func'))
+    df.insert(2, 'FITTING_LOFREQ', pd.to_numeric(params.get('fitting_lofreq')))
+    df.insert(3, 'FITTING_HIFREQ', pd.to_numeric(params.get('fitting_hifreq')))
+    df.insert(4, 'BUFFER_LOFREQ', pd.to_numeric(params.get('psd_buffer_lofreq')))
+    df.insert(5, 'BUFFER_HIFREQ', pd.to_numeric(params.get('psd_buffer_hifreq')))
+    # Runs made before psd_precision was added computed PSDs in float64.
+    df.insert(6, 'PRECISION', params.get('psd_precision', 'float64'))
+    return df
+
+
+def _stack(frames, columns):
+    if not frames:
+        return pd.DataFrame(columns=RUN_COLUMNS + columns)
+    df = pd.concat(frames, ignore_index=True)
+    # Categories differ between runs, so stacked string columns come back
+    # as plain strings.
+    for c in df.columns:
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype(str)
+    return df
+
+
+def read_slopes(runs, subjects=None, channels=None, conditions=None, classes=None,
+                min_age=None, max_age=None, columns=None):
+    """
+    Reads slopes from one or more runs into a single long-format dataframe,
+    loading only the rows and columns asked for. Sweep runs are skipped.
+    Arguments
+        runs:       Run directory, or list of them, e.g. from find_runs.
+        subjects, channels, conditions, classes:
+                    Lists of values to keep. None keeps every value.
+        min_age, max_age:
+                    Inclusive bounds on AGE.
+        columns:    Columns of SLOPES_COLUMNS to return. Defaults to all.
+    Returns
+        Dataframe with RUN_COLUMNS, the requested columns and MONTAGE.
+    """
+    if isinstance(runs, str):
+        runs = [runs]
+    columns = list(columns or SLOPES_COLUMNS) + ['MONTAGE']
+    import pyarrow.dataset as ds
+    filters = []
+    if subjects is not None:
+        filters.append(_isin('SUBJECT', subjects))
+    if channels is not None:
+        filters.append(_isin('CHANNEL', channels))
+    if conditions is not None:
+        filters.append(_isin('CONDITION', conditions))
+    if classes is not None:
+        filters.append(_isin('CLASS', classes))
+    if min_age is not None:
+        filters.append(ds.field('AGE') >= min_age)
+    if max_age is not None:
+        filters.append(ds.field('AGE') <= max_age)
+
+    frames = []
+    for run_dir in runs:
+        if os.path.isdir(os.path.join(run_dir, 'slopes')):
+            df = _read_dataset(os.path.join(run_dir, 'slopes'), columns, filters)
+        elif _results_csvs(run_dir):
+            df = _read_wide_csv(run_dir, columns, subjects, channels, conditions,
+                                classes, min_age, max_age)
+        else:
+            # Sweep runs only have a sweep dataset.
+            continue
+        frames.append(_add_run_columns(df, run_dir))
+    return _stack(frames, columns)
+
+
+def read_psds(runs, subjects=None, channels=None, conditions=None, freq_range=None,
+              columns=None):
+    """
+    Reads PSDs and fit lines from one or more runs into a single long-format
+    dataframe, loading only the rows and columns asked for. Runs without a
+    psds dataset are skipped.
+    Arguments
+        runs:       Run directory, or list of them, e.g. from find_runs.
+        subjects, channels, conditions:
+                    Lists of values to keep. None keeps every value.
+        freq_range: (lo, hi) inclusive range of frequencies to keep.
+        columns:    Columns of PSDS_COLUMNS to return. Defaults to all.
+    Returns
+        Dataframe with RUN_COLUMNS, the requested columns and MONTAGE.
+    """
+    if isinstance(runs, str):
+        runs = [runs]
+    columns = list(columns or PSDS_COLUMNS) + ['MONTAGE']
+    import pyarrow.dataset as ds
+    filters = []
+    if subjects is not None:
+        filters.append(_isin('SUBJECT', subjects))
+    if channels is not None:
+        filters.append(_isin('CHANNEL', channels))
+    if conditions is not None:
+        filters.append(_isin('CONDITION', conditions))
+    if freq_range is not None:
+        filters.append((ds.field('FREQUENCY') >= freq_range[0]) &
+                       (ds.field('FREQUENCY') <= freq_range[1]))
+
+    frames = []
+    for run_dir in runs:
+        if os.path.isdir(os.path.join(run_dir, 'psds')):
+            df = _read_dataset(os.path.join(run_dir, 'psds'), columns, filters)
+            frames.append(_add_run_columns(df, run_dir))
+    return _stack(frames, columns)
@@ -0,0 +1,160 @@
+"""
+Segment selectors, which pick out the parts of a recording that PSDs are
+computed from. A selector is called with a subject's event dataframe and
+sampling rate, and returns an (n_segs, 2) array of [start, stop] latencies.
+
+Subject takes an OrderedDict mapping condition labels to selectors. The
+resting-state conditions are in RS_SELECTORS. For Go-NoGo, CleanSpace takes
+every clean segment, and MarkerWindows and BetweenMarkers take the clean
+data around or between task markers, e.g.:
+    >> Subject('120127101.mat', '120127101.evt',
+               selectors=OrderedDict([('fixation', BetweenMarkers(['FIXATION'],
+                                                  ['GO_PROMPT', 'NOGO_PROMPT']))]))
+
+Selectors are classes rather than closures so that Subject objects holding
+them can be pickled.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from . import events
+
+
+def code_column(df):
+    """
+    Returns the event codes of df as strings. Codes are held in the Type
+    column of EMSE-derived .evt files, and in the Trigger or Event column of
+    BESA-derived ones.
+    """
+    for column in ['Type', 'Trigger', 'Event']:
+        if column in df.columns:
+            return np.asarray(df[column], dtype=str)
+    raise KeyError('Event dataframe has no Type, Trigger or Event column.')
+
+
+def _as_segments(starts, stops):
+    return np.column_stack((starts, stops)).astype(np.int64).reshape(-1, 2)
+
+
+def intersect_segments(segs, clean):
+    """
+    Returns the parts of segs which fall inside of the clean segments, as an
+    (n, 2) array. clean must be sorted and non-overlapping. A segment that
+    spans several clean segments is split into one piece per clean segment.
+    """
+    segs = np.asarray(segs, dtype=np.int64).reshape(-1, 2)
+    clean = np.asarray(clean, dtype=np.int64).reshape(-1, 2)
+    # Range of clean segments [lo, hi) that overlap each segment.
+    lo = np.searchsorted(clean[:, 1], segs[:, 0], side='right')
+    hi = np.searchsorted(clean[:, 0], segs[:, 1], side='left')
+    npieces = np.maximum(hi - lo, 0)
+    seg_idx = np.repeat(np.arange(len(segs)), npieces)
+    clean_idx = np.repeat(lo, npieces) + np.arange(npieces.sum()) - \
+                np.repeat(np.cumsum(npieces) - npieces, npieces)
+    starts = np.maximum(segs[seg_idx, 0], clean[clean_idx, 0])
+    stops = np.minimum(segs[seg_idx, 1], clean[clean_idx, 1])
+    keep = stops > starts
+    return _as_segments(starts[keep], stops[keep])
+
+
+class PairedCodes:
+
+    def __init__(self, event_type):
+        """
+        Selects segments marked by codes beginning with event_type: every
+        <event_type>1 code is paired with the next code of the same type,
+        which marks the end of the segment. For example, PairedCodes('C')
+        selects the segments between C1 and C2 codes.
+        """
+        self.event_type = event_type
+
+
+    def __call__(self, df, srate):
+        codes = code_column(df)
+        latency = df.Latency.values.astype(np.int64)
+        idx = np.flatnonzero(codes.astype('U1') == self.event_type)
+        starts = np.flatnonzero(codes[idx[:-1]] == self.event_type + '1')
+        return _as_segments(latency[idx[starts]], latency[idx[starts + 1]])
+
+
+class CleanSpace:
+
+    def __init__(self, min_length=1024):
+        """
+        Selects every clean segment of a Go-NoGo recording. Files produced by
+        cl_evtBESACleanSegments already mark these with C1/C2 codes. For
+        preprocessed files holding blink and artifact markers instead, the
+        clean segments of at least min_length points are derived from them.
+        """
+        self.min_length = min_length
+
+
+    def __call__(self, df, srate):
+        codes = code_column(df)
+        if not np.isin(codes, ['C1', 'C2']).any():
+            df = events.get_all_clean_space(df.assign(Trigger=codes), self.min_length)
+        return PairedCodes('C')(df, srate)
+
+
+class MarkerWindows:
+
+    def __init__(self, markers, lo_ms, hi_ms, clean=True):
+        """
+        Selects the window [lo_ms, hi_ms] around every code in markers, e.g.
+        MarkerWindows(['FIXATION'], -500, 0) for the half second before each
+        fixation. If clean is True, only the parts of the windows that lie
+        in clean space (see CleanSpace) are kept.
+        """
+        self.markers = list(markers)
+        self.lo_ms = lo_ms
+        self.hi_ms = hi_ms
+        self.clean = clean
+
+
+    def __call__(self, df, srate):
+        latency = df.Latency.values[np.isin(code_column(df), self.markers)].astype(np.int64)
+        segs = _as_segments(latency + int(round(self.lo_ms * srate / 1000)),
+                            latency + int(round(self.hi_ms * srate / 1000)))
+        if self.clean:
+            segs = intersect_segments(segs, CleanSpace()(df, srate))
+        return segs
+
+
+class BetweenMarkers:
+
+    def __init__(self, start_markers, stop_markers, clean=True):
+        """
+        Selects the data from every code in start_markers up to the first
+        code in stop_markers after it, e.g. BetweenMarkers(['RESPONSE'],
+        ['FIXATION']) for the inter-trial interval. If clean is True, only
+        the parts that lie in clean space (see CleanSpace) are kept.
+        """
+        self.start_markers = list(start_markers)
+        self.stop_markers = list(stop_markers)
+        self.clean = clean
+
+
+    def __call__(self, df, srate):
+        codes = code_column(df)
+        latency = df.Latency.values.astype(np.int64)
+        starts = np.sort(latency[np.isin(codes, self.start_markers)])
+        stops = np.sort(latency[np.isin(codes, self.stop_markers)])
+        nxt = np.searchsorted(stops, starts, side='right')
+        paired = nxt < len(stops)
+        segs = _as_segments(starts[paired], stops[nxt[paired]])
+        if self.clean:
+            segs = intersect_segments(segs, CleanSpace()(df, srate))
+        return segs
+
+
+# Resting-state conditions: clean eyes-closed and eyes-open segments, and
+# the eyes-closed and eyes-open trials they sit in.
+RS_SELECTORS = OrderedDict([
+    ('eyesc',        PairedCodes('C')),
+    ('eyeso',        PairedCodes('O')),
+    ('trials_eyesc', PairedCodes('0')),
+    ('trials_eyeso', PairedCodes('1'))
+])
+RS_CONDITIONS = ['eyesc', 'eyeso']
@@ -0,0 +1,429 @@
+"""
+Vectorized helpers for cutting clean segments of a recording into windows
+and computing PSDs from those windows.
+
+Recordings too large to hold in memory, e.g. memory-mapped .npy files from
+eeg_store, can be read a chunk at a time with stream_windows, and their
+PSDs accumulated block by block with WelchAccumulator. Even in memory,
+windows are gathered and transformed in batches of window_batch windows,
+as every window is a copy of nperwindow points.
+
+PSDs are estimated with Welch's method: windows of nperwindow points, each
+overlapping the last by noverlap points, are tapered (see get_taper),
+zero-padded to nfft points and Fourier transformed, and their periodograms
+averaged. The frequency of every point of the PSD is given by
+frequencies(srate, nfft).
+"""
+
+import numpy as np
+import scipy as sp
+import scipy.fft
+import scipy.signal
+import scipy.signal.windows
+
+# Time-halfbandwidth product of DPSS tapers when none is given.
+DPSS_NW = 3
+
+# Number of window points gathered and transformed at once by default, e.g.
+# 16 windows of 1024 points from each of 64 channels, or 8 MB of float64.
+BATCH_POINTS = 2**20
+
+
+def check_windows(nperwindow, noverlap, nfft=None):
+    """
+    Raises ValueError unless windows of nperwindow points overlapping by
+    noverlap points, transformed with nfft points, are valid: noverlap must
+    be in [0, nperwindow) and nfft at least nperwindow.
+    """
+    if nperwindow < 1:
+        raise ValueError('nperwindow must be at least 1, got {}.'.format(nperwindow))
+    if not 0 <= noverlap < nperwindow:
+        raise ValueError('noverlap must be in [0, nperwindow), got {} with nperwindow {}.'.format(
+            noverlap, nperwindow))
+    if nfft is not None and nfft < nperwindow:
+        raise ValueError('nfft must be at least nperwindow, got {} with nperwindow {}.'.format(
+            nfft, nperwindow))
+
+
+def frequencies(srate, nfft):
+    """
+    Returns the frequency, in Hz, of each point of a PSD computed with nfft
+    points at sampling rate srate, shape (nfft//2 + 1,). For example,
+    2-second windows at 512 Hz give 0, 0.5, ..., 256 Hz.
+    """
+    return np.fft.rfftfreq(nfft, 1 / srate)
+
+
+def frequency_mask(f, lofreq, hifreq):
+    """
+    Returns a boolean mask over the frequency vector f selecting the
+    frequencies in [lofreq, hifreq). Frequencies within a millionth of a
+    frequency step of lofreq or hifreq count as equal to them.
+    """
+    f = np.ravel(f)
+    tol = 1e-6 * (f[1] - f[0]) if len(f) > 1 else 0
+    return (f >= lofreq - tol) & (f < hifreq - tol)
+
+
+def get_taper(window, nperwindow):
+    """
+    Returns the taper applied to each window of nperwindow points. window is
+    either any window sp.signal.get_window accepts, e.g. 'hamming' or
+    'hann', giving an array of shape (nperwindow,), or 'dpss' for multitaper
+    estimates, giving the 2*NW - 1 Slepian tapers of time-halfbandwidth NW
+    as an array of shape (n_tapers, nperwindow). NW defaults to DPSS_NW, and
+    can be given as ('dpss', NW) or 'dpss:NW', e.g. 'dpss:4'.
+    Multitaper periodograms average the periodograms of every taper.
+    """
+    if isinstance(window, str) and window.startswith('dpss'):
+        name, _, nw = window.partition(':')
+        window = (name, float(nw)) if nw else (name,)
+    if isinstance(window, tuple) and window[0] == 'dpss':
+        nw = window[1] if len(window) > 1 else DPSS_NW
+        return sp.signal.windows.dpss(nperwindow, nw, Kmax=max(int(2*nw) - 1, 1))
+    return sp.signal.get_window(window, nperwindow)
+
+
+def window_starts(segs, nperwindow=512*2, noverlap=512, nsamples=None):
+    """
+    Returns the sample index at which every window begins, in segment order.
+    Windows are laid out from the start of each segment every
+    nperwindow - noverlap points, and only windows which fit completely
+    inside of their segment are kept.
+    Arguments
+        segs:       List or array of [start, stop] latencies, one per segment.
+        nperwindow: Time-points to use per window.
+        noverlap:   Time-points by which consecutive windows overlap.
+        nsamples:   Length of the recording. If given, segments are clipped to
+                    [0, nsamples], as slicing the recording would.
+    """
+    check_windows(nperwindow, noverlap)
+    step = nperwindow - noverlap
+    segs = np.asarray(segs, dtype=np.int64).reshape(-1, 2)
+    if nsamples is not None:
+        segs = np.clip(segs, 0, nsamples)
+    seglen = segs[:, 1] - segs[:, 0]
+    nwins = np.where(seglen >= nperwindow, (seglen - nperwindow) // step + 1, 0)
+    first = np.cumsum(nwins) - nwins
+    offsets = np.arange(nwins.sum()) - np.repeat(first, nwins)
+    return np.repeat(segs[:, 0], nwins) + offsets * step
+
+
+def strided_windows(data, nperwindow):
+    """
+    Returns a read-only view of data with shape data.shape[:-1] +
+    (n_samples - nperwindow + 1, nperwindow), where [..., i, :] is the
+    window beginning at sample i. No samples are copied.
+    """
+    data = np.asarray(data)
+    nsteps = data.shape[-1] - nperwindow + 1
+    if nsteps < 1:
+        nsteps = 0
+    return np.lib.stride_tricks.as_strided(
+        data,
+        shape=data.shape[:-1] + (nsteps, nperwindow),
+        strides=data.strides[:-1] + (data.strides[-1], data.strides[-1]),
+        writeable=False
+    )
+
+
+def extract_windows(data, starts, nperwindow, dtype=None):
+    """
+    Gathers the windows beginning at each index in starts from data, which
+    is either a single channel (n_samples,) or a recording (n_chan, n_samples).
+    Returns an array of shape data.shape[:-1] + (len(starts), nperwindow).
+
+    The windows are taken from a strided view of data, so the only copy made
+    is the single contiguous block that's returned. If dtype is given (e.g.
+    np.float32), the block is returned in that dtype, and is gathered one
+    channel at a time so that no full-size copy is made in data's dtype.
+    """
+    view = strided_windows(data, nperwindow)
+    starts = np.asarray(starts, dtype=np.int64)
+    if dtype is None or np.dtype(dtype) == view.dtype:
+        return np.ascontiguousarray(view[..., starts, :])
+    windows = np.empty(view.shape[:-2] + (len(starts), nperwindow), dtype=dtype)
+    for idx in np.ndindex(*view.shape[:-2]):
+        windows[idx] = view[idx][starts]
+    return windows
+
+
+def window_batch(shape, nperwindow, max_points=BATCH_POINTS):
+    """
+    Returns the number of windows of nperwindow points to gather at once
+    from data of leading shape shape, e.g. (nbchan,), so that a batch holds
+    at most max_points points. At least one window is always gathered.
+    """
+    return max(1, max_points // (int(np.prod(shape)) * nperwindow))
+
+
+def stream_windows(data, starts, nperwindow, chunk_size, dtype=None):
+    """
+    Yields the windows beginning at each index in starts, in blocks of shape
+    data.shape[:-1] + (n_windows, nperwindow), reading data one time chunk
+    at a time. Each block holds the windows beginning inside of one chunk of
+    chunk_size samples, so windows which straddle the end of a chunk are
+    read along with it. Chunks holding no windows are never read.
+
+    Windows are yielded in order of their start, and together are the same
+    as extract_windows(data, sorted(starts), nperwindow, dtype).
+    """
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1, got {}.'.format(chunk_size))
+    starts = np.sort(np.asarray(starts, dtype=np.int64))
+    chunks = starts // chunk_size
+    for block in np.split(starts, np.flatnonzero(np.diff(chunks)) + 1):
+        if not len(block):
+            continue
+        lo = block[0] // chunk_size * chunk_size
+        yield extract_windows(data[..., lo:block[-1] + nperwindow], block - lo,
+                              nperwindow, dtype)
+
+
+def _window_power(windows, taper, nfft=None):
+    """
+    Returns the power spectrum of each window after removing its mean
+    (periodogram's default 'constant' detrend), tapering it and zero-padding
+    it to nfft points, unscaled. With a (n_tapers, nperwindow) multitaper,
+    the power spectra of every taper are averaged. float32 windows are
+    detrended, tapered and transformed in single precision; scipy.fft keeps
+    them so, where np.fft before NumPy 2 promotes them to double.
+    """
+    segs = windows - windows.mean(axis=-1, keepdims=True)
+    if segs.dtype == np.float32:
+        taper = taper.astype(np.float32)
+    if taper.ndim == 2:
+        spec = sp.fft.rfft(segs[..., np.newaxis, :] * taper, n=nfft, axis=-1)
+        return np.mean(spec.real**2 + spec.imag**2, axis=-2)
+    segs *= taper
+    spec = sp.fft.rfft(segs, n=nfft, axis=-1)
+    return spec.real**2 + spec.imag**2
+
+
+def _scale_psd(psd, srate, taper, nfft=None):
+    """
+    Scales a mean power spectrum of nfft points (the taper's length by
+    default), in place, to a one-sided power spectral density.
+    """
+    if taper.ndim == 2:
+        psd /= srate * np.mean(np.sum(taper**2, axis=-1))
+    else:
+        psd /= srate * np.sum(taper**2)
+    if (nfft or taper.shape[-1]) % 2:
+        psd[..., 1:] *= 2
+    else:
+        psd[..., 1:-1] *= 2
+    return psd
+
+
+def welch_psd(windows, srate, window='hamming', nfft=None):
+    """
+    Computes the PSD of each window and averages them, for any number of
+    channels at once. Matches averaging sp.signal.periodogram(w, srate,
+    window=window) over the windows, but tapers and transforms the whole
+    block in a single real FFT.
+    Arguments
+        windows: Array of shape (..., n_windows, nperwindow), e.g. the
+                 (nbchan, n_windows, nperwindow) output of extract_windows.
+                 float32 windows are transformed in float32, and batches
+                 of window_batch windows are transformed at a time.
+        srate:   Sampling rate of the recording.
+        window:  Taper applied to each window. See get_taper.
+        nfft:    Length of the FFT, zero-padding each window. Defaults to
+                 nperwindow.
+    Returns
+        float64 array of shape (..., nfft//2 + 1) holding the mean PSD, at
+        frequencies(srate, nfft).
+    """
+    windows = np.asarray(windows)
+    nwins, nperwindow = windows.shape[-2:]
+    taper = get_taper(window, nperwindow)
+    # Power is summed in double precision, even for float32 windows, a batch
+    # of windows at a time to bound the memory taken by the transforms.
+    batch = window_batch(windows.shape[:-2], nperwindow)
+    psd = np.zeros(windows.shape[:-2] + ((nfft or nperwindow)//2 + 1,))
+    for i in range(0, nwins, batch):
+        psd += np.sum(_window_power(windows[..., i:i + batch, :], taper, nfft), axis=-2,
+                      dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        psd /= nwins
+    return _scale_psd(psd, srate, taper, nfft)
+
+
+class WelchAccumulator:
+    """
+    Running per-channel sums of window periodograms and window counts, for
+    Welch PSDs of windows that arrive in blocks, e.g. from stream_windows:
+        >> acc = WelchAccumulator(srate, 1024, shape=(nbchan,))
+        >> for windows in stream_windows(data, starts, 1024, chunk_size):
+        ..     acc.add(windows)
+        >> acc.psd(), acc.log_stderr()
+    Only the sums are kept, so memory doesn't grow with the number of
+    windows. The result matches welch_psd over all of the windows, up to
+    floating-point rounding.
+
+    Alongside the sums, the running mean and variance of each window's PSD
+    are kept using Welford's method, merging in a batch of windows at a
+    time, which gives the standard error of the log10 PSD without a second
+    pass over the windows. Blocks are transformed a batch at a time, so
+    memory doesn't grow with the size of a block either.
+    """
+
+    def __init__(self, srate, nperwindow, shape=(), window='hamming', nfft=None, batch=None):
+        """
+        Arguments
+            srate:      Sampling rate of the recording.
+            nperwindow: Length of each window.
+            shape:      Leading shape of each block of windows, e.g.
+                        (nbchan,).
+            window:     Taper applied to each window. See get_taper.
+            nfft:       Length of the FFT. Defaults to nperwindow.
+            batch:      Number of windows of a block to transform at once.
+                        Defaults to window_batch(shape, nperwindow).
+        """
+        check_windows(nperwindow, 0, nfft)
+        self.srate = srate
+        self.taper = get_taper(window, nperwindow)
+        self.nfft = nfft or nperwindow
+        self.batch = batch or window_batch(shape, nperwindow)
+        self.total = np.zeros(tuple(shape) + (self.nfft//2 + 1,))
+        self.count = 0
+        # Running mean of the windows' PSDs, and sum of their squared
+        # deviations from it.
+        self.mean = np.zeros_like(self.total)
+        self.m2 = np.zeros_like(self.total)
+
+    def add(self, windows):
+        """
+        Adds a block of windows of shape shape + (n_windows, nperwindow).
+        """
+        windows = np.asarray(windows)
+        for i in range(0, windows.shape[-2], self.batch):
+            self._add_batch(windows[..., i:i + self.batch, :])
+
+    def _add_batch(self, windows):
+        """
+        Adds a batch of at least one window to the sums, and merges their
+        PSDs into the running mean and variance.
+        """
+        power = _window_power(windows, self.taper, self.nfft)
+        self.total += np.sum(power, axis=-2, dtype=np.float64)
+        n = windows.shape[-2]
+        # Scaled and centred in place, float64 power isn't copied.
+        psds = _scale_psd(power.astype(np.float64, copy=False), self.srate, self.taper, self.nfft)
+        block_mean = psds.mean(axis=-2)
+        psds -= block_mean[..., np.newaxis, :]
+        block_m2 = np.sum(np.square(psds, out=psds), axis=-2)
+        count = self.count + n
+        delta = block_mean - self.mean
+        self.mean += delta * (n / count)
+        self.m2 += block_m2 + delta**2 * (self.count * n / count)
+        self.count = count
+
+    def psd(self):
+        """
+        Returns the mean PSD of every window added so far, of shape
+        shape + (nfft//2 + 1,).
+        """
+        return _scale_psd(self.total / self.count, self.srate, self.taper, self.nfft)
+
+    def variance(self):
+        """
+        Returns the sample variance of the windows' PSDs, of shape
+        shape + (nfft//2 + 1,). NaN with fewer than two windows.
+        """
+        if self.count < 2:
+            return np.full_like(self.m2, np.nan)
+        return self.m2 / (self.count - 1)
+
+    def log_stderr(self, count=None):
+        """
+        Returns the standard error of log10(psd()), the log of the mean PSD
+        that lines are fitted to, from the delta method:
+            SE(log10 P) = sqrt(var(P) / count) / (P * ln(10))
+        where var(P) is the variance of the windows' PSDs. Overlapping
+        windows aren't independent, so count should be their effective
+        number (see effective_count), and defaults to the number of windows
+        added, which understates the error for overlapping windows.
+        """
+        count = count or self.count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(self.variance() / count) / (self.psd() * np.log(10))
+
+
+def _unit_tapers(window, nperwindow):
+    """
+    Returns the taper, or tapers, of get_taper as an array of shape
+    (n_tapers, nperwindow), each scaled to unit energy.
+    """
+    taper = np.atleast_2d(get_taper(window, nperwindow))
+    return taper / np.sqrt(np.sum(taper**2, axis=-1, keepdims=True))
+
+
+def overlap_correlation(window, nperwindow):
+    """
+    Returns the correlation between the PSDs of two windows beginning d
+    points apart, for every d in [0, nperwindow), as an array of shape
+    (nperwindow,). Windows further apart are uncorrelated. This is the
+    squared overlap of the tapered windows (Welch, 1967), exact for
+    Gaussian noise with a flat spectrum and a fair approximation for
+    smooth spectra. With 50% overlap it's about 0.05 for a Hamming window.
+    Multitaper PSDs average the correlation over every pair of tapers.
+    """
+    tapers = _unit_tapers(window, nperwindow)
+    spec = np.fft.rfft(tapers, 2 * nperwindow)
+    # Cross-correlation of every pair of tapers at every lag.
+    xcorr = np.fft.irfft(spec[:, np.newaxis] * np.conj(spec), 2 * nperwindow)[..., :nperwindow]
+    return np.sum(xcorr**2, axis=(0, 1)) / len(tapers)
+
+
+def effective_count(starts, window, nperwindow):
+    """
+    Returns the number of independent windows that would give PSDs of the
+    same variance as the windows beginning at starts, which are correlated
+    where they overlap (see overlap_correlation):
+        n_eff = n^2 / sum over pairs i, j of rho(|start_i - start_j|)
+    For long segments of Hamming windows overlapping by half, that's about
+    0.9 of the number of windows.
+    """
+    starts = np.sort(np.asarray(starts, dtype=np.int64))
+    rho = overlap_correlation(window, nperwindow)
+    total = float(len(starts))
+    for lag in range(1, len(starts)):
+        gaps = starts[lag:] - starts[:-lag]
+        # Gaps only grow with lag, as starts are sorted.
+        if not np.any(gaps < nperwindow):
+            break
+        total += 2 * np.sum(rho[gaps[gaps < nperwindow]])
+    return len(starts)**2 / total if len(starts) else 0.0
+
+
+def bin_correlation(window, nperwindow, nfft=None):
+    """
+    Returns the correlation between points of a PSD m frequency steps
+    apart, for every m in [0, nfft//2 + 1), as an array of that shape. The
+    taper spreads power over neighbouring frequencies, and zero-padding to
+    nfft > nperwindow spaces frequencies more finely than that spread, so
+    neighbouring points of a PSD aren't independent. For a Hamming window
+    without zero-padding, adjacent points are correlated by about 0.4. As
+    with overlap_correlation, this is exact for Gaussian noise with a flat
+    spectrum.
+    """
+    nfft = nfft or nperwindow
+    tapers = _unit_tapers(window, nperwindow)
+    spec = np.fft.fft(tapers[:, np.newaxis] * tapers, nfft)[..., :nfft//2 + 1]
+    return np.sum(np.abs(spec)**2, axis=(0, 1)) / len(tapers)
+
+
+def relative_difference(psd, reference):
+    """
+    Returns the largest relative difference between psd and reference, e.g.
+    between PSDs computed from float32 windows and the float64 reference,
+    ignoring points where the reference is zero.
+    """
+    psd = np.asarray(psd, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    nonzero = reference != 0
+    if not nonzero.any():
+        return 0.0
+    return float(np.max(np.abs(psd[nonzero] - reference[nonzero]) / np.abs(reference[nonzero])))
@@ -0,0 +1,515 @@
+import concurrent.futures
+from collections import OrderedDict
+
+import numpy as np
+import scipy as sp
+import pandas as pd
+import scipy.io
+import scipy.signal
+
+from . import fitting
+from . import eeg_store
+from . import spectral
+from .segments import RS_SELECTORS, RS_CONDITIONS, code_column
+from .events import rm_intertrial_segs
+
+# Precisions compute_ch_psds can window, taper and transform data in.
+PRECISIONS = ['float64', 'float32']
+
+# Record dtype of Subject.segments. cond indexes into the subject's
+# selector labels.
+SEGMENT_DTYPE = np.dtype([('start', np.int64), ('stop', np.int64), ('cond', np.int8)])
+
+class Subject:
+
+    def __init__(self, importpath, importpath_evt, group='', age=0, sex=0,
+                 selectors=None, conditions=None):
+        """
+        importpath is either an EEGLAB-exported .mat file, or a .npy file
+        produced by eeg_store.py. The latter is memory-mapped rather than
+        read into memory. importpath_evt is either the path to a processed
+        .evt file, or the already processed events as a dataframe, which is
+        copied rather than modified.
+        Arguments
+            selectors:  OrderedDict mapping condition labels to segment
+                        selectors (see segments.py). Defaults to the
+                        resting-state eyes-closed/eyes-open segments and
+                        trials, selectors.RS_SELECTORS.
+            conditions: Labels of the selectors that compute_ch_psds and
+                        fit_slopes run on. Defaults to ['eyesc', 'eyeso'] with
+                        the default selectors, and every label otherwise.
+        """
+        self.group  = group
+        self.age    = age
+        self.sex    = sex
+        if importpath.endswith('.npy'):
+            info, self.data = eeg_store.load(importpath)
+            self.name   = info['name']
+            self.srate  = info['srate']
+            self.chans  = info['chans']
+        else:
+            datafile = sp.io.loadmat(importpath)
+            self.name   = str(np.squeeze(datafile['name']))
+            self.srate  = int(np.squeeze(datafile['srate']))
+            self.data   = np.squeeze(datafile['data'])
+            if 'chans' in datafile:
+                self.chans = [ch[0].astype(str) for ch in np.squeeze(datafile['chans'])]
+            else:
+                self.chans = [str(ch) for ch in range(len(self.data))]
+        self.nbchan = len(self.data)
+        if selectors is None:
+            selectors = RS_SELECTORS
+            conditions = conditions or RS_CONDITIONS
+        self.selectors  = OrderedDict(selectors)
+        self.conditions = list(conditions or self.selectors)
+        self.events = {}
+        if isinstance(importpath_evt, pd.DataFrame):
+            self.events['df'] = importpath_evt.copy()
+        else:
+            self.events['df'] = pd.read_csv(importpath_evt, sep='\t')
+        self._construct_event_hierarchy()
+
+
+    def _construct_event_hierarchy(self):
+        """
+        Builds self.segments, a table with one row per segment holding its
+        start and stop latencies and a condition code, the index of the
+        selector that picked it. Each condition's [start, stop] pairs are
+        also kept in self.events[condition] as an (n_segs, 2) array.
+
+        Resting-state trial codes are three digits long in the processed
+        .evt files, and are first shortened to their reversed first two
+        digits, e.g. '101' -> '01'.
+        """
+        if 'Type' in self.events['df'].columns:
+            types = self.events['df'].Type.astype(str)
+            self.events['df'].Type = types.where(types.str.len() != 3,
+                                                 types.str[0:2].str[::-1])
+        codes = code_column(self.events['df'])
+        self.events['types'] = set(c[0] for c in codes if c)
+
+        tables = []
+        for code, (label, selector) in enumerate(self.selectors.items()):
+            segs = selector(self.events['df'], self.srate)
+            table = np.empty(len(segs), dtype=SEGMENT_DTYPE)
+            table['start'] = segs[:, 0]
+            table['stop'] = segs[:, 1]
+            table['cond'] = code
+            tables.append(table)
+            self.events[label] = segs
+        self.segments = np.concatenate(tables) if tables else np.empty(0, dtype=SEGMENT_DTYPE)
+
+
+    def get_segments(self, seg_type):
+        """
+        Returns the (n_segs, 2) array of [start, stop] latencies of segments
+        of seg_type, one of the selector labels, e.g. 'eyesc' or 'trials_eyeso'.
+        """
+        code = list(self.selectors).index(seg_type)
+        segs = self.segments[self.segments['cond'] == code]
+        return np.column_stack((segs['start'], segs['stop']))
+
+
+    def _update_event_hierarchy(self):
+        """
+        Checks to make sure that clean segments fall inside of trials, for
+        example after editing trial codes in self.events['df'] by hand.
+        """
+        self.events['df'] = rm_intertrial_segs(self.events['df'])
+        self._construct_event_hierarchy()
+
+
+    def modify_trial_length(self, lower_bound, upper_bound):
+        """
+        Reduces or increases trial lengths and modifies clean segment
+        markers to reflect new trial lengths.
+        Arguments
+            lower_bound : float (seconds)
+                Specifies lower bound for new trial length
+            upper_bound : float (seconds)
+                Specifies upper bound for new trial length
+
+        For example, limiting 60-second trials down to 30-second ones
+        would be done like so:
+            >> s = Subject('1121181181.mat', '1121181181.evt')
+            >> s.modify_trial_length(0, 30)
+        """
+        df = self.events['df']
+        types = df.Type.values.astype(str)
+        latency = df.Latency.values.astype(np.int64)
+
+        # Pair each trial start code with the first trial stop code after it,
+        # and move both relative to the trial's original start.
+        trial_starts = np.flatnonzero(np.isin(types, ['01', '11']))
+        stops = np.flatnonzero(np.isin(types, ['02', '12']))
+        nxt = np.searchsorted(stops, trial_starts, side='right')
+        trial_starts = trial_starts[nxt < len(stops)]
+        trial_stops = stops[nxt[nxt < len(stops)]]
+        onset = latency[trial_starts]
+        latency[trial_stops] = onset + int(round(upper_bound * self.srate))
+        latency[trial_starts] = onset + int(round(lower_bound * self.srate))
+
+        keep = self._clip_segments_to_trials(types, latency, latency[trial_starts],
+                                             latency[trial_stops])
+        df = df.assign(Latency=latency)[keep]
+        self.events['df'] = df.set_index(np.arange(0, df.shape[0], 1))
+        self._construct_event_hierarchy()
+
+
+    def _clip_segments_to_trials(self, types, latency, trial_lo, trial_hi):
+        """
+        Clips clean segment codes in latency (modified in place) to the
+        trials [trial_lo, trial_hi]. Segment heads outside of a trial move
+        to the start of the next trial, and tails to the end of the previous
+        one. Returns a boolean mask of the events to keep, which excludes
+        segments lying wholly between two trials.
+        """
+        order = np.argsort(trial_lo)
+        trial_lo, trial_hi = trial_lo[order], trial_hi[order]
+
+        # Index of the last trial starting at or before each segment code,
+        # and whether the code falls inside of that trial.
+        starts = np.concatenate([np.flatnonzero(types == 'C1'), np.flatnonzero(types == 'O1')])
+        stops = np.concatenate([np.flatnonzero(types == 'C2'), np.flatnonzero(types == 'O2')])
+        k_start = np.searchsorted(trial_lo, latency[starts], side='right') - 1
+        k_stop = np.searchsorted(trial_lo, latency[stops], side='right') - 1
+        in_start = (k_start >= 0) & (latency[starts] <= trial_hi[np.maximum(k_start, 0)])
+        in_stop = (k_stop >= 0) & (latency[stops] <= trial_hi[np.maximum(k_stop, 0)])
+
+        keep = np.ones(len(types), dtype=bool)
+        bad = ~in_start & ~in_stop & (k_start == k_stop)
+        keep[starts[bad]] = False
+        keep[stops[bad]] = False
+
+        head = ~in_start & ~bad
+        tail = ~in_stop & ~bad
+        latency[starts[head]] = trial_lo[np.minimum(k_start[head] + 1, len(trial_lo) - 1)]
+        latency[stops[tail]] = trial_hi[np.maximum(k_stop[tail], 0)]
+        return keep
+
+
+    def get_windows(self, seg_type, nperwindow=512*2, noverlap=512, dtype=None):
+        """ Grabs windows of data of size nperwindow, each overlapping the last
+        by noverlap points as in Welch's method, from every channel at once.
+        Arguments
+            seg_type:   String, specifies what segments to use. One of the
+                        selector labels, e.g. 'eyesc' or 'eyeso'.
+            nperwindow: Time-points to use per window. Default value, provided sampling rate
+                        is 512 Hz, is 2 seconds.
+            noverlap:   Time-points by which consecutive windows overlap, in
+                        [0, nperwindow). Default is 50%.
+            dtype:      dtype of the returned windows, e.g. np.float32.
+                        Defaults to that of self.data.
+        Returns
+            Array of shape (nbchan, n_windows, nperwindow), gathered from a
+            strided view of self.data.
+        """
+        starts = spectral.window_starts(self.get_segments(seg_type), nperwindow, noverlap,
+                                        nsamples=self.data.shape[-1])
+        return spectral.extract_windows(self.data, starts, nperwindow, dtype)
+
+
+    def welch(self, windows, srate):
+        """
+        Takes a list of data segments (each size 1xN), computes each segment's PSD,
+        and averages them to get a final PSD. Also takes a block of windows of
+        shape (nbchan, n_windows, N), returning one PSD per channel.
+        """
+        return spectral.welch_psd(windows, srate, window='hamming')
+
+
+    def _choose_windows(self, nwins, nwins_upperlimit, rng):
+        """
+        Returns the sorted indices of at most nwins_upperlimit windows out
+        of nwins, picked at random with the np.random.RandomState rng, or a
+        slice over all of them.
+        """
+        if nwins <= nwins_upperlimit:
+            return slice(None)
+        return np.sort(rng.permutation(nwins)[:nwins_upperlimit])
+
+
+    def remove_freq_buffer(self, data, lofreq, hifreq):
+        """
+        Removes a frequency buffer, the frequencies of self.f in
+        [lofreq, hifreq), from a PSD or frequency vector.
+        """
+        data = np.ravel(data)[~spectral.frequency_mask(self.f, lofreq, hifreq)]
+        return data.reshape(len(data), 1)
+
+
+    def _accumulate_ch_psds(self, data, starts, nperwindow, window, nfft, precision, reference,
+                            chunk_size):
+        """
+        Computes PSDs of the windows beginning at starts in data, all of
+        self.data or a block of its channels, for compute_ch_psds. Windows
+        are added to a spectral.WelchAccumulator in batches of
+        spectral.window_batch windows, or with chunk_size, one chunk of
+        data at a time, which the accumulator transforms in the same
+        batches. Batches are sized on every channel of self.data, so that
+        they don't depend on the block. Returns the accumulator, and
+        another holding float64 reference PSDs if reference is True (None
+        otherwise).
+        """
+        shape = data.shape[:-1]
+        batch = spectral.window_batch((self.nbchan,), nperwindow)
+        psds = spectral.WelchAccumulator(self.srate, nperwindow, shape, window, nfft, batch)
+        reference_psds = spectral.WelchAccumulator(self.srate, nperwindow, shape, window, nfft,
+                                                   batch)
+        dtype = np.float64 if reference else np.dtype(precision)
+        if chunk_size:
+            blocks = spectral.stream_windows(data, starts, nperwindow, chunk_size, dtype)
+        else:
+            blocks = (spectral.extract_windows(data, starts[i:i + batch], nperwindow, dtype)
+                      for i in range(0, len(starts), batch))
+        for windows in blocks:
+            if reference:
+                reference_psds.add(windows)
+                windows = windows.astype(precision)
+            psds.add(windows)
+        return psds, reference_psds if reference else None
+
+
+    def compute_ch_psds(self, nwins_upperlimit=0, nperwindow=512*2, noverlap=512,
+                        window='hamming', nfft=None, precision='float64', reference=False,
+                        chunk_size=0, threads=1, random_state=None):
+        """
+        Returns subj data structure with calculated PSDS and subject
+        information.
+        Arguments:
+            nwins_upperlimit : int
+                Upper limit on number of windows we use to compute the
+                PSD. Default is 0, which means no upper limit.
+            nperwindow, noverlap : int
+                Window length and overlap, in time-points, as in
+                get_windows. Longer windows give a finer frequency
+                resolution, and more overlap more windows to average.
+            window : str or tuple
+                Taper applied to each window, e.g. 'hamming', 'hann', or
+                'dpss' for multitaper estimates. See spectral.get_taper.
+            nfft : int
+                Length of the FFT, zero-padding each window. Defaults to
+                nperwindow. self.f holds the frequency of every point of
+                the PSDs, from srate and nfft.
+            precision : str
+                One of PRECISIONS. 'float32' windows, tapers and transforms
+                the data in single precision, halving the memory taken by
+                the windows. Power is always averaged in double precision.
+            reference : bool
+                Also computes float64 PSDs from the same windows, kept in
+                self.reference_psds for precision_error.
+            chunk_size : int
+                If non-zero, reads self.data this many samples at a time,
+                keeping running sums of each chunk's periodograms. Windows
+                which straddle the end of a chunk are read along with it.
+                Reading a chunk at a time pays off for memory-mapped .npy
+                recordings from eeg_store. Otherwise windows are gathered
+                in batches of spectral.window_batch windows. Either way,
+                peak memory doesn't depend on the length of the recording,
+                and PSDs match up to floating-point rounding.
+            threads : int
+                Number of threads to compute PSDs with. Channels are split
+                into this many blocks, each windowed and transformed in its
+                own thread from views of the same self.data, as NumPy
+                releases the GIL while transforming. PSDs are the same as
+                with threads=1. Useful when subjects can't be processed in
+                parallel, e.g. when inspecting a single subject.
+            random_state : np.random.RandomState or int
+                Picks the windows kept under nwins_upperlimit, or seeds the
+                RandomState that does. Fixing it makes the picks, and so the
+                PSDs, the same in every run. None draws a fresh seed.
+        Alongside each PSD, self.psds[ch][cond + '_stderr'] holds the
+        standard error of its log10 at every frequency, from the spread of
+        the windows' PSDs and their effective number, overlapping windows
+        being correlated (see spectral.WelchAccumulator.log_stderr and
+        spectral.effective_count). self.bin_correlation holds the
+        correlation between points of the PSDs, for compute_slopes. Raises
+        a ValueError if a condition has no full windows.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError("Unknown precision '{}'. Options are: {}".format(
+                precision, ', '.join(PRECISIONS)))
+        self.precision = precision
+        self.reference_psds = {}
+        self.psds = {}
+        spectral.check_windows(nperwindow, noverlap, nfft)
+        self.f = spectral.frequencies(self.srate, nfft or nperwindow)
+        self.f = self.f.reshape(len(self.f), 1)
+        self.bin_correlation = spectral.bin_correlation(window, nperwindow, nfft)
+        rng = random_state
+        if not isinstance(rng, np.random.RandomState):
+            rng = np.random.RandomState(random_state)
+
+        for ch in range(self.nbchan):
+            self.psds[ch] = {}
+        # Blocks of channels to compute in parallel, as views of self.data.
+        blocks = [self.data]
+        if threads > 1:
+            blocks = [self.data[chans[0]:chans[-1] + 1]
+                      for chans in np.array_split(np.arange(self.nbchan), threads) if len(chans)] or blocks
+        with concurrent.futures.ThreadPoolExecutor(len(blocks)) as pool:
+            for cond in self.conditions:
+                starts = spectral.window_starts(self.get_segments(cond), nperwindow, noverlap,
+                                                nsamples=self.data.shape[-1])
+                if len(starts) == 0:
+                    raise ValueError("Subject {}: condition '{}' has no segments long enough "
+                                     "for a window of {} points".format(self.name, cond,
+                                                                        nperwindow))
+                if nwins_upperlimit:
+                    starts = starts[self._choose_windows(len(starts), nwins_upperlimit, rng)]
+                args = (starts, nperwindow, window, nfft, precision, reference, chunk_size)
+                accs = list(pool.map(lambda data: self._accumulate_ch_psds(data, *args), blocks))
+                if reference:
+                    self.reference_psds[cond] = np.concatenate([ref.psd() for _, ref in accs])
+                psds = np.concatenate([acc.psd() for acc, _ in accs])
+                nwins = spectral.effective_count(starts, window, nperwindow)
+                stderrs = np.concatenate([acc.log_stderr(nwins) for acc, _ in accs])
+                for ch in range(self.nbchan):
+                    self.psds[ch][cond] = psds[ch]
+                    self.psds[ch][cond + '_stderr'] = stderrs[ch]
+                # Number of windows behind each condition's PSDs, e.g.
+                # self.nwins_eyesc.
+                setattr(self, 'nwins_' + cond, len(starts))
+        self.data = [] # Clear it from memory since it's no longer needed.
+
+
+    def linreg_slope(self, f, psd, lofreq, hifreq):
+        """
+        Fits line to the PSD, using simple linear regression.
+        Returns slope and fit line.
+        """
+        slopes, _, fitlines = fitting.linreg_fit(f, np.ravel(psd)[np.newaxis],
+                                                 self._fitting_mask(f, lofreq, hifreq))
+        return slopes * (10**2), fitlines[0].reshape(len(f), 1)
+
+
+    def ransac_slope(self, f, psd, lofreq, hifreq, random_state=None):
+        """
+        Robustly fits line to the PSD, using the RANSAC algorithm.
+        Returns slope and fit line.
+        """
+        slopes, _, fitlines = fitting.ransac_fit(f, np.ravel(psd)[np.newaxis],
+                                                 self._fitting_mask(f, lofreq, hifreq),
+                                                 random_state=random_state)
+        return slopes * (10**2), fitlines[0].reshape(len(f), 1)
+
+
+    def _fitting_mask(self, f, lofreq, hifreq):
+        """
+        Returns a boolean mask over a (buffer-removed) frequency vector f,
+        selecting the frequencies in the fitting range [lofreq, hifreq).
+        """
+        return spectral.frequency_mask(f, lofreq, hifreq)
+
+
+    def compute_slopes(self, regr_func_str='ransac',
+                       buffer_lofreq=7, buffer_hifreq=14,
+                       fitting_lofreq=2, fitting_hifreq=24, random_state=0, psds=None):
+        """
+        Fits a line to every channel's PSDs, for every condition, at once,
+        without storing the results. The frequency buffer is removed from
+        both the PSDs and the frequency vector, and a buffer of 0-0 removes
+        nothing. psds optionally maps each condition to an (nbchan, n_freqs)
+        array to fit in place of self.psds, e.g. self.reference_psds.
+        Returns
+            slopes:   Slopes (x 10^2), shape (nbchan, n_conditions).
+            fitlines: Fit lines, shape (nbchan, n_conditions, n_freqs).
+            f:        Frequency vector the lines were fitted over, with the
+                      buffer removed, shape (n_freqs, 1).
+            stderrs:  Standard errors of the slopes (x 10^2), propagated
+                      from the standard errors of the log10 PSDs in
+                      self.psds over the points each line was fitted to,
+                      i.e. the inliers for RANSAC, allowing for the
+                      correlation between neighbouring points (see
+                      fitting.linreg_stderr), shape (nbchan, n_conditions).
+        """
+        conds = self.conditions
+        f = self.remove_freq_buffer(self.f, buffer_lofreq, buffer_hifreq)
+        if psds is None:
+            psds = {cond: [self.psds[ch][cond] for ch in range(self.nbchan)] for cond in conds}
+        psds = np.array([np.ravel(self.remove_freq_buffer(psds[cond][ch],
+                                                          buffer_lofreq, buffer_hifreq))
+                         for ch in range(self.nbchan) for cond in conds])
+        mask = self._fitting_mask(f, fitting_lofreq, fitting_hifreq)
+        stderrs = np.array([np.ravel(self.remove_freq_buffer(self.psds[ch][cond + '_stderr'],
+                                                             buffer_lofreq, buffer_hifreq))
+                            for ch in range(self.nbchan) for cond in conds])
+        if regr_func_str == 'linreg':
+            slopes, _, fitlines = fitting.linreg_fit(f, psds, mask)
+            fitted = mask
+        elif regr_func_str == 'ransac':
+            slopes, _, fitlines, fitted = fitting.ransac_fit(f, psds, mask,
+                                                             random_state=random_state,
+                                                             return_inliers=True)
+        else:
+            raise ValueError("Unknown fitting function '{}'.".format(regr_func_str))
+        stderrs = fitting.linreg_stderr(f, stderrs, fitted, self.bin_correlation,
+                                        fstep=self.f[1, 0] - self.f[0, 0])
+        return (slopes.reshape(self.nbchan, len(conds)) * (10**2),
+                fitlines.reshape(self.nbchan, len(conds), len(f)), f,
+                stderrs.reshape(self.nbchan, len(conds)) * (10**2))
+
+
+    def fit_slopes(self, regr_func_str='ransac',
+                    buffer_lofreq=7, buffer_hifreq=14,
+                    fitting_lofreq=2, fitting_hifreq=24, random_state=0):
+        """
+        Fits a line to every channel's PSDs, for every condition, at once,
+        and stores the slopes, their standard errors and fit lines in
+        self.psds. random_state seeds RANSAC, so that repeated runs produce
+        the same slopes.
+        """
+        slopes, fitlines, self.f_rm_alpha, stderrs = self.compute_slopes(
+            regr_func_str, buffer_lofreq, buffer_hifreq, fitting_lofreq,
+            fitting_hifreq, random_state)
+        for ch in range(self.nbchan):
+            for i, cond in enumerate(self.conditions):
+                self.psds[ch][cond + '_rm_alpha'] = self.remove_freq_buffer(
+                    self.psds[ch][cond], buffer_lofreq, buffer_hifreq)
+                self.psds[ch][cond + '_slope'] = np.array([slopes[ch, i]])
+                self.psds[ch][cond + '_slope_stderr'] = np.array([stderrs[ch, i]])
+                self.psds[ch][cond + '_fitline'] = fitlines[ch, i].reshape(-1, 1)
+
+
+    def sweep_slopes(self, grid, random_state=0):
+        """
+        Fits slopes for every point of a parameter grid, reusing the PSDs
+        computed once by compute_ch_psds. The grid is stored in self.grid,
+        the slopes in self.grid_slopes and their standard errors in
+        self.grid_stderrs, each of shape (len(grid), nbchan, n_conditions).
+        Arguments
+            grid: List of (fitting_lofreq, fitting_hifreq, buffer_lofreq,
+                  buffer_hifreq, fitting_func) tuples.
+        Every grid point gives the same slopes as fit_slopes run with its
+        parameters and random_state.
+        """
+        self.grid = [tuple(point) for point in grid]
+        fits = [self.compute_slopes(func, buffer_lo, buffer_hi, fitting_lo, fitting_hi,
+                                    random_state)
+                for fitting_lo, fitting_hi, buffer_lo, buffer_hi, func in self.grid]
+        self.grid_slopes = np.array([fit[0] for fit in fits])
+        self.grid_stderrs = np.array([fit[3] for fit in fits])
+
+
+    def precision_error(self, regr_func_str='ransac',
+                        buffer_lofreq=7, buffer_hifreq=14,
+                        fitting_lofreq=2, fitting_hifreq=24, random_state=0):
+        """
+        Compares the PSDs against the float64 reference PSDs kept by
+        compute_ch_psds(reference=True), and the slopes fitted to each.
+        Returns an OrderedDict mapping each condition to a tuple of the
+        largest relative PSD difference and the largest absolute slope
+        difference (x 10^2) over channels.
+        """
+        if not self.reference_psds:
+            raise ValueError('No reference PSDs. Run compute_ch_psds with reference=True.')
+        args = (regr_func_str, buffer_lofreq, buffer_hifreq, fitting_lofreq,
+                fitting_hifreq, random_state)
+        slopes = self.compute_slopes(*args)[0]
+        reference = self.compute_slopes(*args, psds=self.reference_psds)[0]
+        errors = OrderedDict()
+        for i, cond in enumerate(self.conditions):
+            psds = np.array([np.ravel(self.psds[ch][cond]) for ch in range(self.nbchan)])
+            errors[cond] = (spectral.relative_difference(psds, self.reference_psds[cond]),
+                            float(np.max(np.abs(slopes[:, i] - reference[:, i]))))
+        return errors
@@ -11,14 +11,13 @@ import getopt
 import datetime
 
 import numpy as np
-import scipy as sp
 import pandas as pd
-import scipy.io
-import scipy.signal
-from sklearn import linear_model
 from collections import OrderedDict
 
-from subject import Subject
+# Use the psdslope package from this checkout if it isn't installed.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+from psdslope import Subject
+from psdslope.metadata import read_metadata, join_recordings
 
 ###############################################################################
 
@@ -123,13 +122,8 @@ def main(argv):
     for f in matfiles:
         if f.split('/')[-1][0:3] == '120':
             matfiles.remove(f)
-    df = pd.read_csv('data/auxilliary/ya-oa.csv')
-    df.SUBJECT = df.SUBJECT.astype(str)
-    df.CLASS   = df.CLASS.astype(str)
-    df.AGE     = df.AGE.astype(int)
-
-    subjects = set(map(lambda x: x.split('/')[-1][:-4], matfiles))
-    missing = subjects - set(df.SUBJECT)
+    metadata = read_metadata('data/auxilliary/ya-oa.csv')
+    joined, missing = join_recordings(metadata, matfiles, params['import_dir_evt'])
     if len(missing) != 0:
         for s in missing:
             print('ERROR: Specified csv does not contain information for subject {}'.format(s))
@@ -138,14 +132,10 @@ def main(argv):
 
     subj = {}
     subj['nbsubj'] = len(matfiles)
-    for i in range(len(matfiles)):
-        
-        subj_name = matfiles[i].split('/')[-1][:-4]
-        print('Processing: {}'.format(subj_name))
-        group = df[df.SUBJECT == subj_name].CLASS.values[0]
-        age   = df[df.SUBJECT == subj_name].AGE.values[0]
-        sex   = df[df.SUBJECT == subj_name].SEX.values[0]
-        subj[i] = Subject(matfiles[i], params['import_dir_evt'] + subj_name + '.evt', group, age, sex)
+    for i, row in enumerate(joined.itertuples()):
+
+        print('Processing: {}'.format(row.Index))
+        subj[i] = Subject(row.MATFILE, row.EVTFILE, row.CLASS, row.AGE, row.SEX)
 
         print('Computing PSDs... ', end='')
         if params['trial_protocol'] == 'match_OA':
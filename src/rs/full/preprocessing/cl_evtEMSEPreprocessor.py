@@ -7,12 +7,12 @@ Usage:
     $ python cl_evtEMSEPreprocessor.py -i importpath -o exportpath
 
 Notes:
-rm_irrelevant_xml removes unneeded markers from the xml files.
-These are the following: '[seg]', '222', '252', '223', '255', as well as
-the unneeded headings at the top of the files, such as <bUseQID>.
-
-Once these are clean, transform_xml_to_df imports the files and produces
-tab-separated csv files containing the event information, using Pandas.
+preprocess_evt reads each raw file once, streaming through its <Event>
+elements. It skips unneeded markers ('[seg]', '222', '252', '223', '255'),
+splits clean segments into start/stop codes, and drops clean segments
+that sit in the intertrial space, writing one tab-separated file per
+input. The multi-pass functions rm_irrelevant_xml, transform_xml_to_df
+and rm_entire_trial_segs perform the same steps one directory at a time.
 
 cl_evtEMSEPreprocessor takes files that look like:
 
@@ -37,13 +37,24 @@ import os
 import sys
 import glob
 import getopt
+from xml.etree import ElementTree
 
-import xmltodict
 import numpy as np
 import pandas as pd
 
+# Use the psdslope package from this checkout if it isn't installed.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+from psdslope import events
+
 ################################################################################
 
+# Event codes which aren't needed for the analysis.
+IRRELEVANT_CODES = ['[seg]', '222', '223', '252', '255']
+
+# Codes marking the beginning and end of eyes closed/open trials.
+TRIALS_START = ('11', '10')
+TRIALS_STOP  = ('21', '20')
+
 # Auxilliary functions
 
 def get_filelist(import_path, extension):
@@ -56,31 +67,31 @@ def get_filelist(import_path, extension):
         return filelist
 
 
+def iter_xml_events(filepath):
+    """
+    Yields (name, start, stop) for each <Event> in an EMSE .evt file, in file
+    order. The file is read incrementally and each element is discarded once
+    it has been yielded, so the whole document is never held in memory.
+    """
+    for _, elem in ElementTree.iterparse(filepath, events=('end',)):
+        if elem.tag == 'Event':
+            yield elem.findtext('Name'), elem.findtext('Start'), elem.findtext('Stop')
+            elem.clear()
+
+
 def get_event_file(filepath, include_clean_segs=True):
     events = {}
-    xmlevents = xmltodict.parse(open(filepath).read())
-    xmlevents = xmlevents['EMSE_Event_List']['Event']
     n = 0
-    for i in range(len(xmlevents)):
-        if include_clean_segs is True and xmlevents[i]['Name'] in ['C', 'O']:
+    for name, start, stop in iter_xml_events(filepath):
+        if include_clean_segs is True and name in ['C', 'O']:
             # First, add front of clean segment
-            events[n] = {'type': '', 'latency': 0, 'urevent': 0}
-            events[n]['type'] = xmlevents[i]['Name'] + '1'
-            events[n]['latency'] = int(xmlevents[i]['Start'])
-            events[n]['urevent'] = n
-
-            # Then add the end of the clean segment
+            events[n] = {'type': name + '1', 'latency': int(start), 'urevent': n}
             n += 1
-            events[n] = {'type': '', 'latency': 0, 'urevent': 0}
-            events[n]['type'] = xmlevents[i]['Name'] + '2'
-            events[n]['latency'] = int(xmlevents[i]['Stop'])
-            events[n]['urevent'] = n
+            # Then add the end of the clean segment
+            events[n] = {'type': name + '2', 'latency': int(stop), 'urevent': n}
             n += 1
-        if len(xmlevents[i]['Name']) == 3 and xmlevents[i]['Name'] not in ['255', '222', '223', '252']:
-            events[n] = {'type': '', 'latency': 0, 'urevent': 0}
-            events[n]['type'] = xmlevents[i]['Name']
-            events[n]['latency'] = int(xmlevents[i]['Start'])
-            events[n]['urevent'] = n
+        if len(name) == 3 and name not in IRRELEVANT_CODES:
+            events[n] = {'type': name, 'latency': int(start), 'urevent': n}
             n += 1
     return events
 
@@ -148,15 +159,10 @@ def get_next_trial(code_latency, trials):
 def in_intertrial(code_latency, trials):
     """
     Returns boolean specifying whether the given latency sits inside of the
-    intertrial space defined by the dataframe trials.
+    intertrial space defined by the dataframe trials. Latencies before the
+    first trial are in intertrial space.
     """
-    try:
-        if get_previous_trial(code_latency, trials).Type.all()[0:2] in TRIALS_STOP:
-            return True
-        else:
-            return False
-    except:
-        return True
+    return bool(events.intertrial_mask([code_latency], trials, TRIALS_STOP)[0])
 
 
 def print_seg_code_information(df, fname, i, trials, error_type):
@@ -301,51 +307,79 @@ def rm_entire_trial_segs(import_path, export_path):
 
 
 def rm_intertrial_segs(import_path, export_path):
-    SEGS_START = ['C1', 'O1']
-    SEGS_STOP = ['C2', 'O2']
-    TRIALS_START = ['11', '10']
-    TRIALS_STOP = ['21', '20']
+    """
+    Trims or removes clean segments which sit partially or completely in
+    the intertrial space. See psdslope.events.rm_intertrial_segs.
+    """
     files = get_filelist(import_path, 'evt')
     for f in files:
         fname = f.split('/')[-1]
         df = pd.read_csv(f, sep='\t')
         df.Type = df.Type.astype(str)
         df.Latency = df.Latency.astype(int)
+        df = events.rm_intertrial_segs(df, TRIALS_START, TRIALS_STOP)
+        df.to_csv(export_path + fname, sep='\t', index=False)
 
-        trials = df[[code[0:2] in TRIALS_START + TRIALS_STOP for code in df.Type]]
-        found_bad_segs = False
 
-        # CASE 1: Remove segments that fall completely in intertrial space.
-        bad_idx = []
-        for i in range(df.shape[0]):
-            if df.iloc[i].Type in SEGS_START and (in_intertrial(df.iloc[i].Latency, trials) and
-                                                  in_intertrial(df.iloc[i+1].Latency, trials)):
-                # print_seg_code_information(df, i, trials, 'INTERTRIAL')
-                bad_idx.append(i)
-                bad_idx.append(i+1)
-                found_bad_segs = True
-        df = df.drop(df.index[bad_idx])
-        df = df.set_index(np.arange(0, df.shape[0], 1))
+def preprocess_evt(filepath, srate=512, max_intertrial_seg=29):
+    """
+    Reads a raw EMSE-exported .evt file in a single streaming pass and
+    returns its Type/Latency dataframe. Produces the same result as running
+    rm_irrelevant_xml, transform_xml_to_df and rm_entire_trial_segs in turn:
+    the '[seg]', 222, 223, 252 and 255 markers are skipped, clean segments
+    are split into C1/C2 (O1/O2) codes, and clean segments lying in the
+    intertrial space that are longer than max_intertrial_seg seconds are
+    dropped as they're read.
 
-        # Trim clean segments that sit partially in intertrial space.
-        for i in range(df.shape[0]):
+    Parameters
+    ----------
+    filepath : str
+        Path to a raw EMSE .evt file.
+
+    srate : int
+        Sampling rate of the recording, used to convert segment lengths
+        to seconds.
+
+    max_intertrial_seg : float
+        Clean segments starting in the intertrial space and longer than
+        this many seconds are removed.
+    """
+    TYPES_START = ['11', '10']
+    TYPES_STOP  = ['21', '20']
+    types, latencies = [], []
+    intertrial = True
+    for name, start, stop in iter_xml_events(filepath):
+        if name in ['C', 'O']:
+            start, stop = int(start), int(stop)
+            if intertrial and (stop - start)/srate > max_intertrial_seg:
+                continue
+            types += [name + '1', name + '2']
+            latencies += [start, stop]
+        elif len(name) == 3 and name not in IRRELEVANT_CODES:
+            if name[0:2] in TYPES_START:
+                intertrial = False
+            elif name[0:2] in TYPES_STOP:
+                intertrial = True
+            types.append(name)
+            latencies.append(int(start))
 
-            # CASE 2: Segment head sits inside of the intertrial space. Trim the front of the segment.
-            if df.iloc[i].Type[0:2] in SEGS_START and in_intertrial(df.iloc[i].Latency, trials):
-                # print_seg_code_information(df, fname, i, trials, 'TRIM HEAD')
-                df.at[i, 'Latency'] = get_next_trial(df.iloc[i].Latency, trials).at[0, 'Latency']
-                found_bad_segs = True
+    df = pd.DataFrame(data={'Type': types, 'Latency': latencies})
+    df = df[['Type', 'Latency']]
 
-            # CASE 3: Segment tail sits inside of the intertrial space. Trim the end of the segment.
-            if df.iloc[i].Type[0:2] in SEGS_STOP and in_intertrial(df.iloc[i].Latency, trials):
-                # print_seg_code_information(df, fname, i, trials, 'TRIM TAIL')
-                df.at[i, 'Latency'] = get_previous_trial(df.iloc[i].Latency, trials).at[0, 'Latency']
-                found_bad_segs = True
+    # Subject 112118266 contains an extra erroneous trial which we
+    # simply remove from the processed .evt file.
+    if os.path.basename(filepath) == '112118266.evt':
+        df = df[:-1]
+    return df
 
-        if found_bad_segs:
-            print()
 
-        df.to_csv(export_path + fname, sep='\t', index=False)
+def preprocess_file(import_file, export_file):
+    """
+    Preprocesses a single raw .evt file and writes it to export_file as a
+    tab-separated dataframe.
+    """
+    df = preprocess_evt(import_file)
+    df.to_csv(export_file, sep='\t', index=False)
 
 
 ## Parameters ##################################################################
@@ -358,8 +392,7 @@ def main(argv):
     Parameters
     ----------
     import_path : str
-        Absolute path to EMSE-exported .evt files in xml format,
-        cleaned through remove_irrelevant_xml.
+        Absolute path to raw EMSE-exported .evt files in xml format.
 
     export_path : str
         Absolute path to directory in which to save tab-separated
@@ -370,20 +403,8 @@ def main(argv):
     params = get_cmdline_params(params)
 
     print('Processing .evt files... ', end='')
-    rm_irrelevant_xml(params['import_path'], params['export_path'])
-    transform_xml_to_df(params['export_path'], params['export_path'])
-    rm_entire_trial_segs(params['export_path'], params['export_path'])
-
-    # Subject 112118266 contains an extra erroneous trial which we
-    # simply remove from the processed .evt file:
-    files = get_filelist(params['export_path'], 'evt')
-    for i in range(len(files)):
-        if files[i].split('/')[-1] == '112118266.evt':
-            with open(files[i]) as bad_file:
-                lines = bad_file.readlines()
-            w = open(files[i], 'w')
-            w.writelines([event for event in lines[:-1]])
-            w.close()
+    for f in get_filelist(params['import_path'], 'evt'):
+        preprocess_file(f, params['export_path'] + f.split('/')[-1])
 
     print('Done.')
 
@@ -0,0 +1,138 @@
+"""
+Checks the vectorized PSD and line-fitting code of the psdslope package
+against reference implementations, and checks that the ways of computing
+PSDs which are documented to agree do. Run from the repository root with:
+    $ python -m pytest -q tests
+"""
+
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy as sp
+import scipy.io
+import scipy.signal
+
+# Use the psdslope package from this checkout if it isn't installed.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from psdslope import Subject, CleanSpace, spectral, fitting
+
+SRATE = 512
+
+
+def power_law_psds(nspectra, rng, noise=0.02):
+    """
+    Returns a frequency vector and nspectra PSDs whose log10 falls on a line
+    with a random slope, plus a little noise, along with those slopes.
+    """
+    f = spectral.frequencies(SRATE, 1024)
+    slopes = rng.uniform(-0.05, -0.01, nspectra)
+    intercepts = rng.uniform(0, 2, nspectra)
+    logpsds = (intercepts[:, np.newaxis] + slopes[:, np.newaxis] * f +
+               noise * rng.randn(nspectra, len(f)))
+    return f, 10**logpsds, slopes
+
+
+def test_linreg_fit_matches_polyfit():
+    rng = np.random.RandomState(0)
+    f, psds, _ = power_law_psds(5, rng)
+    mask = spectral.frequency_mask(f, 2, 24)
+    slopes, intercepts, fitlines = fitting.linreg_fit(f, psds, mask)
+    for i, psd in enumerate(psds):
+        slope, intercept = np.polyfit(f[mask], np.log10(psd[mask]), 1)
+        assert slopes[i] == pytest.approx(slope, rel=1e-10)
+        assert intercepts[i] == pytest.approx(intercept, rel=1e-10)
+        np.testing.assert_allclose(fitlines[i], intercept + slope * f, rtol=1e-10)
+
+
+@pytest.mark.parametrize('nperwindow, noverlap, nfft', [
+    (1024, 512, None),
+    (512, 0, None),
+    (1024, 256, 2048),
+    (500, 250, 501),
+])
+def test_welch_psd_matches_scipy(nperwindow, noverlap, nfft):
+    x = np.random.RandomState(1).randn(2, SRATE * 20)
+    starts = spectral.window_starts([[0, x.shape[-1]]], nperwindow, noverlap)
+    windows = spectral.extract_windows(x, starts, nperwindow)
+    f, expected = sp.signal.welch(x, SRATE, window='hamming', nperseg=nperwindow,
+                                  noverlap=noverlap, nfft=nfft, detrend='constant')
+    np.testing.assert_allclose(spectral.frequencies(SRATE, nfft or nperwindow), f)
+    np.testing.assert_allclose(spectral.welch_psd(windows, SRATE, 'hamming', nfft), expected,
+                               rtol=1e-10)
+
+    # Accumulated in small batches and blocks of windows, too.
+    acc = spectral.WelchAccumulator(SRATE, nperwindow, (2,), 'hamming', nfft, batch=3)
+    for block in np.array_split(windows, 4, axis=1):
+        acc.add(block)
+    np.testing.assert_allclose(acc.psd(), expected, rtol=1e-10)
+
+
+def test_ransac_fit_ignores_outliers():
+    rng = np.random.RandomState(2)
+    f, psds, true_slopes = power_law_psds(20, rng, noise=0.005)
+    mask = spectral.frequency_mask(f, 2, 24)
+    # Push a few points in the fitting range far off the line, as a strong
+    # alpha peak would.
+    outliers = np.flatnonzero(mask)[[10, 11, 12, 30]]
+    psds[:, outliers] *= 1000
+
+    slopes, _, _, inliers = fitting.ransac_fit(f, psds, mask, random_state=0,
+                                               return_inliers=True)
+    np.testing.assert_allclose(slopes, true_slopes, atol=2e-3)
+    assert not inliers[:, outliers].any()
+    assert not inliers[:, ~mask].any()
+    # Least squares is thrown by the outliers.
+    assert np.all(np.abs(fitting.linreg_fit(f, psds, mask)[0] - true_slopes) > 2e-3)
+    # Fits are reproducible from the seed.
+    np.testing.assert_array_equal(fitting.ransac_fit(f, psds, mask, random_state=0)[0], slopes)
+
+
+@pytest.fixture
+def subject(tmp_path):
+    """
+    Returns a function making an 8-channel Go-NoGo subject with three clean
+    segments, read from a .mat file written to tmp_path.
+    """
+    rng = np.random.RandomState(3)
+    matfile = str(tmp_path / 'subj.mat')
+    sp.io.savemat(matfile, {'data': rng.randn(8, SRATE * 60), 'name': 'subj', 'srate': SRATE,
+                            'chans': np.array(['A{}'.format(i) for i in range(8)],
+                                              dtype=object)})
+    events = pd.DataFrame({'Latency': [1000, 9000, 10000, 25000, 26000, 30000],
+                           'Trigger': ['C1', 'C2', 'C1', 'C2', 'C1', 'C2']})
+    selectors = OrderedDict([('clean', CleanSpace())])
+    return lambda: Subject(matfile, events, selectors=selectors)
+
+
+def computed_psds(subj, **kwargs):
+    subj.compute_ch_psds(**kwargs)
+    return (np.array([subj.psds[ch]['clean'] for ch in range(subj.nbchan)]),
+            np.array([subj.psds[ch]['clean_stderr'] for ch in range(subj.nbchan)]))
+
+
+def test_compute_ch_psds_threads_and_chunks_agree(subject):
+    psds, stderrs = computed_psds(subject())
+
+    # Threads give the same PSDs, bit for bit.
+    for threads in [2, 3, 8]:
+        threaded = computed_psds(subject(), threads=threads)
+        np.testing.assert_array_equal(threaded[0], psds)
+        np.testing.assert_array_equal(threaded[1], stderrs)
+
+    # Reading a chunk at a time gives the same PSDs up to rounding, and
+    # threads don't change them either.
+    chunked = computed_psds(subject(), chunk_size=5000)
+    np.testing.assert_allclose(chunked[0], psds, rtol=1e-12)
+    np.testing.assert_allclose(chunked[1], stderrs, rtol=1e-9)
+    threaded = computed_psds(subject(), chunk_size=5000, threads=3)
+    np.testing.assert_array_equal(threaded[0], chunked[0])
+    np.testing.assert_array_equal(threaded[1], chunked[1])
+
+    # And they match the Welch PSD of each segment's windows.
+    subj = subject()
+    windows = subj.get_windows('clean', 1024, 512)
+    np.testing.assert_allclose(spectral.welch_psd(windows, SRATE), psds, rtol=1e-12)